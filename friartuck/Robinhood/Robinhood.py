@@ -34,6 +34,7 @@ from six.moves.urllib.request import getproxies
 from six.moves import input
 from . import exceptions as RH_exception
 from _datetime import datetime
+from friartuck import http_client
 
 class Bounds(Enum):
     """enum for bounds in `historicals` endpoint"""
@@ -236,7 +237,15 @@ class Robinhood:
 
     def get_url_content_json(self, url):
         """fetch url content"""
-        res = self.session.get(url)
+        return http_client.single_flight.do(self._request_key(url), lambda: self._get_json(url))
+
+    def _request_key(self, url, params=None):
+        # the responses depend on the session's login, only calls of the same session (and token) share one
+        return http_client.request_key(url, params, identity="%x:%s" % (id(self.session), self.auth_token))
+
+    def _get_json(self, url, params=None):
+        # the session GET behind the json endpoints, concurrent identical requests share one call
+        res = self.session.get(url, params=params)
         res.raise_for_status()  #will throw without auth
         data = res.json()
         return data
@@ -304,9 +313,7 @@ class Robinhood:
             url = str(self.endpoints['quotes']) + "?symbols=" + str(stock)
         #Check for validity of symbol
         try:
-            res = self.session.get(url)
-            res.raise_for_status()  # auth required
-            data = res.json()
+            data = http_client.single_flight.do(self._request_key(url), lambda: self._get_json(url))  # auth required
         except requests.exceptions.HTTPError:
             raise NameError('Invalid Symbol: ' + stock) #TODO: custom exception
 
@@ -411,11 +418,8 @@ class Robinhood:
             'span': span,
             'bounds': bounds.name.lower()
         }
-        res = self.session.get(
-            self.endpoints['historicals'],
-            params=params
-        )
-        return res.json()
+        return http_client.single_flight.do(self._request_key(self.endpoints['historicals'], params),
+                                            lambda: self.session.get(self.endpoints['historicals'], params=params).json())
 
     def get_news(self, stock):
         """fetch news endpoint
@@ -1,74 +1,89 @@
 import json
 from datetime import timedelta, datetime
 import pandas as pd
-import urllib.request
+from friartuck import http_client
+
+
+def from_config(config):
+    return AlphaVantage(config.get('ALPHA_VANTAGE', 'apikey'))
 
 
 class AlphaVantage(object):
-    def __init__(self, apikey):
+    def __init__(self, apikey, base_url="https://www.alphavantage.co"):
         self.apikey = apikey
-        pass
+        self.base_url = base_url
 
-    def get_quote_daily(self, symbol, bars=22):
+    def get_quote_daily(self, symbol, bars=22, fields=None):
 
         output_size = "compact"
         if bars > 100:
             output_size = 'full'
 
-        url = "https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol=%s&datatype=json&outputsize=%s&apikey=%s" % (symbol.lower(), output_size, self.apikey)
+        url = "%s/query?function=TIME_SERIES_DAILY&symbol=%s&datatype=json&outputsize=%s&apikey=%s" % (self.base_url, symbol.lower(), output_size, self.apikey)
 
         print(url)
         quote_bars = None
-        with urllib.request.urlopen(url) as response:
-            content = response.read()
+        content = http_client.get_content(url)
 
         # resp, content = self.client.request(url, "GET")
         # print(content)
         data = json.loads(content.decode('utf-8'))
         # print(data)
-        if "Time Series (Daily)" in data:
+        if "Time Series (Daily)" in data and data["Time Series (Daily)"]:
             quotes = data["Time Series (Daily)"]
 
             # print(quotes)
             print(len(quotes))
 
-            for date_str in quotes:
-                quote_data = quotes[date_str]
-                quote_date = datetime.strptime(date_str, "%Y-%m-%d")
-                bar = pd.DataFrame(index=pd.DatetimeIndex([quote_date]),
-                                   data={'price': float(quote_data['4. close']),
-                                         'open': float(quote_data['1. open']),
-                                         'high': float(quote_data['2. high']),
-                                         'low': float(quote_data['3. low']),
-                                         'close': float(quote_data['4. close']),
-                                         'volume': int(quote_data['5. volume']),
-                                         'date': quote_date})
-
-                # print(close)
-                if quote_bars is None:
-                    quote_bars = bar
-                else:
-                    quote_bars = bar.append(quote_bars)
+            date_strs = list(quotes)
+            quote_dates = [datetime.strptime(date_str, "%Y-%m-%d") for date_str in date_strs]
+            closes = [float(quotes[date_str]['4. close']) for date_str in date_strs]
+            quote_bars = pd.DataFrame(index=pd.DatetimeIndex(quote_dates), columns=BAR_FIELDS,
+                                      data={'price': closes,
+                                            'open': [float(quotes[date_str]['1. open']) for date_str in date_strs],
+                                            'high': [float(quotes[date_str]['2. high']) for date_str in date_strs],
+                                            'low': [float(quotes[date_str]['3. low']) for date_str in date_strs],
+                                            'close': closes,
+                                            'volume': [int(quotes[date_str]['5. volume']) for date_str in date_strs],
+                                            'date': quote_dates})
 
         if quote_bars is None:
             # log.warn("Unexpected, could not retrieve quote for security (%s) " % symbol)
-            # bars = pd.DataFrame(index=[6], columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'])
+            # e.g. {"Note": ...} when the api call frequency is exceeded
             quote_date = datetime.now()
             quote_date = quote_date.replace(second=0, microsecond=0)
-            bars = pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
-                                data={'price': float("nan"),
-                                      'open': float("nan"),
-                                      'high': float("nan"),
-                                      'low': float("nan"),
-                                      'close': float("nan"),
-                                      'volume': int(0),
-                                      'date': quote_date})
+            quote_bars = pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
+                                      data={'price': float("nan"),
+                                            'open': float("nan"),
+                                            'high': float("nan"),
+                                            'low': float("nan"),
+                                            'close': float("nan"),
+                                            'volume': int(0),
+                                            'date': quote_date})
 
         # print(bars)
         quote_bars.sort_index(inplace=True)
+        if fields:
+            quote_bars = quote_bars[[field for field in BAR_FIELDS if field in fields]]
         return quote_bars.tail(bars)
 
-    def get_quote_intraday(self, symbol, since_last_quote_time, interval='5min'):
+    def get_quote_intraday(self, symbol, since_last_quote_time, interval='5min', fields=None):
+        url, since_last_quote_time = self.intraday_request(symbol, since_last_quote_time, interval)
+
+        print(url)
+        content = http_client.get_content(url)
+
+        # resp, content = self.client.request(url, "GET")
+        # print(content)
+        data = json.loads(content.decode('utf-8'))
+        # print(data)
+        return intraday_bars(data, interval, since_last_quote_time, fields)
+
+    def parse_intraday(self, data, interval, since_last_quote_time, fields=None):
+        # bars out of an answer to intraday_request fetched elsewhere (the asyncio engine)
+        return intraday_bars(data, interval, since_last_quote_time, fields)
+
+    def intraday_request(self, symbol, since_last_quote_time, interval='5min'):
         if not since_last_quote_time:
             since_last_quote_time = datetime.now().replace(hour=8, minute=25, second=0, microsecond=0)
 
@@ -87,77 +102,52 @@ class AlphaVantage(object):
             if diff > 100:
                 output_size = 'full'
 
-        url = "https://www.alphavantage.co/query?function=TIME_SERIES_INTRADAY&symbol=%s&datatype=json&outputsize=%s&interval=%s&apikey=%s" % (symbol.lower(), output_size, interval, self.apikey)
+        url = "%s/query?function=TIME_SERIES_INTRADAY&symbol=%s&datatype=json&outputsize=%s&interval=%s&apikey=%s" % (self.base_url, symbol.lower(), output_size, interval, self.apikey)
 
-        print(url)
-        quote_bars = None
-        with urllib.request.urlopen(url) as response:
-            content = response.read()
+        return url, since_last_quote_time
 
-        # resp, content = self.client.request(url, "GET")
-        # print(content)
-        data = json.loads(content.decode('utf-8'))
-        # print(data)
-        connected = False
-        # quote_dates = []
-        time_series_key = "Time Series (%s)" % interval
-        if time_series_key in data:
-            quotes = data[time_series_key]
 
-            # print(quotes)
-            print("since_last_quote_time(%s), returned length(%s)" % (since_last_quote_time, len(quotes)))
-            if len(quotes) > 0:
-                connected = True
-
-            for date_str in quotes:
-                quote_data = quotes[date_str]
-                minute_adjust = 0
-                """
-                if interval != "1min":
-                    minute_adjust = int(interval.replace("min", ""))
-                """
-
-                quote_date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:00") - timedelta(hours=1, minutes=minute_adjust)
-
-                # quote_dates.append(quote_date.strftime("%Y-%m-%d %H:%M:00"))
-                if since_last_quote_time >= quote_date:
-                    continue
-
-                bar = pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date', 'connected'],
-                                   data={'price': float(quote_data['4. close']),
-                                         'open': float(quote_data['1. open']),
-                                         'high': float(quote_data['2. high']),
-                                         'low': float(quote_data['3. low']),
-                                         'close': float(quote_data['4. close']),
-                                         'volume': int(quote_data['5. volume']),
-                                         'date': quote_date,
-                                         'connected': connected})
-
-                # print(close)
-                if quote_bars is None:
-                    quote_bars = bar
-                else:
-                    quote_bars = bar.append(quote_bars)
-
-        # print("quote_dates %s" % quote_dates)
-        if quote_bars is None:
-            # log.warn("Unexpected, could not retrieve quote for security (%s) " % symbol)
-            # bars = pd.DataFrame(index=[6], columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'])
-            quote_date = datetime.now()
-            quote_date = quote_date.replace(second=0, microsecond=0)
-            quote_bars = pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date', 'connected'],
-                                      data={'price': float("nan"),
-                                            'open': float("nan"),
-                                            'high': float("nan"),
-                                            'low': float("nan"),
-                                            'close': float("nan"),
-                                            'volume': int(0),
-                                            'date': quote_date,
-                                            'connected': connected})
+# AlphaVantage keys of the bar columns, price is the close
+QUOTE_KEYS = {'price': '4. close', 'open': '1. open', 'high': '2. high', 'low': '3. low', 'close': '4. close', 'volume': '5. volume'}
+BAR_FIELDS = ['price', 'open', 'high', 'low', 'close', 'volume', 'date']
 
-        # print(bars)
-        quote_bars.sort_index(inplace=True)
-        return quote_bars
+
+def intraday_bars(data, interval, since_last_quote_time, fields=None):
+    # only the bar columns in fields (all by default) are parsed out of the answer, connected is always there
+    columns = [field for field in BAR_FIELDS if fields is None or field in fields] + ['connected']
+    connected = False
+    time_series_key = "Time Series (%s)" % interval
+    quote_dates = []
+    quotes = []
+    if time_series_key in data:
+        time_series = data[time_series_key]
+
+        print("since_last_quote_time(%s), returned length(%s)" % (since_last_quote_time, len(time_series)))
+        if len(time_series) > 0:
+            connected = True
+
+        for date_str in time_series:
+            quote_date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:00") - timedelta(hours=1)
+            if since_last_quote_time >= quote_date:
+                continue
+
+            quote_dates.append(quote_date)
+            quotes.append(time_series[date_str])
+
+    if len(quotes) == 0:
+        quote_date = datetime.now().replace(second=0, microsecond=0)
+        nan_bar = {'price': float("nan"), 'open': float("nan"), 'high': float("nan"), 'low': float("nan"),
+                   'close': float("nan"), 'volume': int(0), 'date': quote_date, 'connected': connected}
+        return pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=columns, data={column: nan_bar[column] for column in columns})
+
+    bar_data = {'date': quote_dates, 'connected': [connected] * len(quotes)}
+    for field in columns:
+        if field in QUOTE_KEYS:
+            bar_data[field] = [(int if field == 'volume' else float)(quote[QUOTE_KEYS[field]]) for quote in quotes]
+
+    quote_bars = pd.DataFrame(index=pd.DatetimeIndex(quote_dates), columns=columns, data={column: bar_data[column] for column in columns})
+    quote_bars.sort_index(inplace=True)
+    return quote_bars
 
 
 def is_valid_value(value, default):
@@ -29,14 +29,26 @@ import traceback
 
 import numpy as np
 import logging
-import pandas as pd
 
 from datetime import datetime, timedelta
 from friartuck.Robinhood import Robinhood
 from friartuck.quote_source import FriarTuckQuoteSource
+from friartuck.async_quote_source import SyncFriarTuckQuoteSource
+from friartuck.history_planner import HistoryPlanner, covers_window, widen_window
+from friartuck.history_panel import build_panel, panel_fields
+from friartuck.stale_quote_source import StaleWhileRevalidateQuoteSource
+from friartuck.quote_adapters import AdapterRegistry
+from friartuck.robinhood_quote_source import RobinhoodQuoteSource
+from friartuck.quote_source import fetch_fields
+from friartuck.freshness import INTRADAY_MINUTES
+from friartuck.quote_subscriptions import QuoteSubscriptions, fetch_latest_quotes
+from friartuck.rolling_windows import RollingWindowStore
+from friartuck.current_bar import CurrentBar
+from friartuck.striped_lock import StripedLock
 from friartuck import utc_to_local
 from collections import Iterable
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 
 log = logging.getLogger("friar_tuck")
 
@@ -88,20 +100,38 @@ class FriarData:
         Int bar_count: Number of quote records to return
         String frequency: 1m|1h|1d
         String field[1...n]: None=All, possible fields ["open","high","low","close","volume","price"] 
+        Boolean panel: True returns a HistoryPanel, the bars of every security aligned in one (time x symbol x field) array
+        Dict outcomes: when given, filled with {symbol: "fresh"|"stale"|"missing"}, stale bars being the last good ones
+        served while the source is behind or failing (history_stats() counts them over all calls)
     """
 
-    def history(self, security, bar_count=1, frequency="1d", field=None):
-        return self.friar_tuck_live.history(security, bar_count, frequency, field)
+    def history(self, security, bar_count=1, frequency="1d", field=None, panel=False, outcomes=None):
+        return self.friar_tuck_live.history(security, bar_count, frequency, field, panel=panel, outcomes=outcomes)
+
+    def history_stats(self):
+        return self.friar_tuck_live.history_stats()
 
     """
     Params: 
         Security security[1...n]: can be a list
-        String field[1...n]: None=All, possible fields ["open","high","low","close","volume","price"] 
+        String field[1...n]: None=All (a CurrentBar, to_series() converts it), possible fields ["open","high","low","close","volume","price","bid_price","bid_size","ask_price","ask_size"] 
     """
 
     def current(self, security, field=None):
         return self.friar_tuck_live.current(security, field)
 
+    """
+    Params: 
+        Security security[1...n]: can be a list, its quotes are polled in the background ([QUOTE_SOURCE] quote_poll = yes)
+        so current() reads them from memory
+    """
+
+    def subscribe(self, security):
+        self.friar_tuck_live.subscribe_quotes(security)
+
+    def unsubscribe(self, security):
+        self.friar_tuck_live.unsubscribe_quotes(security)
+
     def can_trade(self, security):
         return self.friar_tuck_live.can_trade(security)
 
@@ -199,20 +229,6 @@ class Account:
         return str(self.__dict__)
 
 
-def synchronized_method(method):
-    outer_lock = threading.Lock()
-    lock_name = "__" + method.__name__ + "_lock" + "__"
-
-    def sync_method(self, *args, **kws):
-        with outer_lock:
-            if not hasattr(self, lock_name): setattr(self, lock_name, threading.Lock())
-            lock = getattr(self, lock_name)
-            with lock:
-                return method(self, *args, **kws)
-
-    return sync_method
-
-
 class FriarTuckLive:
     config = None
     context = None
@@ -241,10 +257,43 @@ class FriarTuckLive:
             self._active_datetime = datetime.now()
             # self._active_datetime = temp_datetime.replace(second=0, microsecond=0)
             # self.long_only=False
-            self.quote_source = FriarTuckQuoteSource(config)
+            # the robinhood adapter (history_provider/daily_providers = robinhood) reuses the session logged in below
+            adapters = AdapterRegistry(config)
+            adapters.register('robinhood', lambda adapter_config: RobinhoodQuoteSource(self.rh_session))
+            friar_tuck_quote_source = FriarTuckQuoteSource(config, adapters)
+            # current() waits on it for the bar of the interval that just ended, see FreshnessTracker
+            self.freshness = friar_tuck_quote_source.freshness
+            if config.get('QUOTE_SOURCE', 'engine', fallback='threads') == 'async':
+                self.quote_source = SyncFriarTuckQuoteSource(config, friar_tuck_quote_source)
+            else:
+                self.quote_source = friar_tuck_quote_source
+            # current() asks this one, never a cache
+            self.live_quote_source = self.quote_source
+            if config.getboolean('QUOTE_SOURCE', 'stale_while_revalidate', fallback=False):
+                self.quote_source = StaleWhileRevalidateQuoteSource(self.quote_source,
+                                                                    grace=config.getint('QUOTE_SOURCE', 'stale_grace', fallback=10),
+                                                                    max_stale=config.getint('QUOTE_SOURCE', 'max_stale', fallback=60),
+                                                                    block_budget=config.getfloat('QUOTE_SOURCE', 'block_budget', fallback=2.0))
+            self.history_planner = HistoryPlanner(self.quote_source)
+            # [QUOTE_SOURCE] rolling_windows = yes keeps each security's history in a window only the new bars are
+            # fetched for, see RollingWindowStore
+            self.rolling_windows = None
+            if config.getboolean('QUOTE_SOURCE', 'rolling_windows', fallback=False):
+                self.rolling_windows = RollingWindowStore(self.quote_source)
+            # {FRESH | STALE | MISSING: symbols served} over every history call, see history_stats()
+            self._history_outcomes = {}
+            self._history_outcome_lock = threading.Lock()
+            self.quote_executor = ThreadPoolExecutor(max_workers=config.getint('QUOTE_SOURCE', 'max_workers', fallback=8))
+            self.security_locks = StripedLock(stripes=config.getint('QUOTE_SOURCE', 'lock_stripes', fallback=64))
             self.context = FriarContext()
             self.rh_session = Robinhood()
             self.rh_session.login(username=config.get('LOGIN', 'username'), password=config.get('LOGIN', 'password'))
+            # [QUOTE_SOURCE] quote_poll = yes polls the quotes of the subscribed symbols (and of the positions held)
+            # every quote_poll_interval seconds, current() uses them while a poll saw them within quote_max_age seconds
+            self.quote_poll = config.getboolean('QUOTE_SOURCE', 'quote_poll', fallback=False)
+            self.quote_max_age = config.getfloat('QUOTE_SOURCE', 'quote_max_age', fallback=15)
+            self.quote_subscriptions = QuoteSubscriptions(self.rh_session, interval=config.getfloat('QUOTE_SOURCE', 'quote_poll_interval', fallback=5),
+                                                          executor=self.quote_executor)
             self.friar_data = FriarData(self)
 
     def set_active_algo(self, active_algo):
@@ -269,6 +318,14 @@ class FriarTuckLive:
             self.run_thread.setDaemon(True)
             self.run_thread.start()
 
+        if self.quote_poll:
+            self.quote_subscriptions.start()
+
+        if self._data_frequency in INTRADAY_MINUTES:
+            # marks the bars of the symbols current() is asked for ready as soon as the source publishes them
+            self.freshness.start_probe(lambda symbols, since_last_quote_time: self.quote_source.fetch_intraday_quotes(symbol=symbols, since_last_quote_time=since_last_quote_time, frequency=self._data_frequency),
+                                       INTRADAY_MINUTES[self._data_frequency], is_open=lambda: self.is_market_open)
+
     def stop_engine(self):
         if not self.run_thread or not self.run_thread.is_alive():
             return
@@ -282,12 +339,34 @@ class FriarTuckLive:
             time.sleep(1)
             if self.stop_engine:
                 break
+        self.quote_subscriptions.stop()
+        self.freshness.stop_probe()
         self.engine_running = False
         log.info("**** exiting - %s" % name)
 
-    def history(self, security, bar_count=1, frequency="1d", field=None, since_last_quote_time=None):
+    def history(self, security, bar_count=1, frequency="1d", field=None, since_last_quote_time=None, panel=False, outcomes=None):
         symbol_map = security_to_symbol_map(security)
-        quotes = self.quote_source.fetch_quotes(symbol=symbol_map.keys(), bar_count=bar_count, frequency=frequency, field=field, market_open=self.is_market_open, since_last_quote_time=since_last_quote_time)
+        symbol_outcomes = {}
+        if panel:
+            # the panel is built from DataFrames, with close to find the placeholder bars of symbols without quotes
+            fields = panel_fields(field)
+            field = fetch_fields(fields)
+
+        if since_last_quote_time is None and self.rolling_windows is not None and frequency in self.quote_source.allowed_history_frequency:
+            quotes = self.rolling_windows.fetch(symbols=list(symbol_map.keys()), bar_count=bar_count, frequency=frequency, field=field, market_open=self.is_market_open, bar_time=self._active_datetime, outcomes=symbol_outcomes)
+        elif since_last_quote_time is None:
+            quotes = self.history_planner.fetch(symbols=list(symbol_map.keys()), bar_count=bar_count, frequency=frequency, field=field, market_open=self.is_market_open, bar_time=self._active_datetime, outcomes=symbol_outcomes)
+        else:
+            quotes = self.quote_source.fetch_quotes(symbol=symbol_map.keys(), bar_count=bar_count, frequency=frequency, field=field, market_open=self.is_market_open, since_last_quote_time=since_last_quote_time, outcomes=symbol_outcomes)
+
+        with self._history_outcome_lock:
+            for outcome in symbol_outcomes.values():
+                self._history_outcomes[outcome] = self._history_outcomes.get(outcome, 0) + 1
+        if outcomes is not None:
+            outcomes.update(symbol_outcomes)
+
+        if panel:
+            return build_panel(quotes, list(security) if isinstance(security, Iterable) else [security], fields)
 
         if not isinstance(security, Iterable):
             return quotes[security.symbol]
@@ -301,88 +380,109 @@ class FriarTuckLive:
     def can_trade(self, security):
         return security.is_tradeable
 
-    @synchronized_method
     def current(self, security, field, since_last_quote_time=None):
-        now_secs = datetime.now().second
-        if now_secs < 10:
-            # we need to wait 10 seconds after the minute to load current data... this is so the source can be ready.
-            time.sleep(10 - now_secs)
-
+        symbols = [sec.symbol for sec in security] if isinstance(security, Iterable) else [security.symbol]
+        if self._data_frequency in INTRADAY_MINUTES:
+            # the source needs a few seconds after the bar boundary to publish the bar that just ended, the probe
+            # watches for it; wait only until it is in, or as long as the source usually takes
+            self.freshness.watch(symbols)
+            self.freshness.wait_ready(symbols, INTRADAY_MINUTES[self._data_frequency])
+
+        # calls for other securities go on in parallel, the ones for the same security one at a time
+        with self.security_locks.locked(symbols):
+            return self._current(security, field, since_last_quote_time)
+
+    def _current(self, security, field, since_last_quote_time=None):
+        # the interval processor starts a new dict every interval, this call keeps using the one it started with
+        current_bars = self._current_security_bars
+        # only the bar columns field needs are fetched, a later call for other fields fetches the bar again with both
+        fields = fetch_fields(field)
         if not isinstance(security, Iterable):
-            if security not in self._current_security_bars:
-                security_bars = self.history(security, bar_count=1, frequency=self._data_frequency, field=None, since_last_quote_time=since_last_quote_time)
+            if not covers_window(_current_window(current_bars.get(security)), 1, fields):
+                fields = _widen_current_fields([current_bars.get(security)], fields)
+                security_bars = self._fetch_current_bars(security, since_last_quote_time, fields)
                 # log.info(security_bars)
-                self._current_security_bars[security] = security_bars
-
-            if self._current_security_bars[security] is None or self._current_security_bars[security].empty:
-                quote_date = datetime.now()
-                quote_date = quote_date.replace(second=0, microsecond=0)
-                self._current_security_bars[security] = pd.DataFrame(index=pd.DatetimeIndex([quote_date]),
-                                                                     data={'price': float("nan"),
-                                                                           'open': float("nan"),
-                                                                           'high': float("nan"),
-                                                                           'low': float("nan"),
-                                                                           'close': float("nan"),
-                                                                           'volume': int(0)})
-
-            # print("price %s " % self._current_security_bars[security].iloc[-1]["price"])
-            if self._current_security_bars[security] is not None:  # and (not self._current_security_bars[security].empty or self._current_security_bars[security].iloc[-1]["price"] == float["nan"]):
-                last_price_list = self.rh_session.get_quote_list(security.symbol, 'symbol,last_trade_price,bid_price,bid_size,ask_price,ask_size')
-                if last_price_list and len(last_price_list) > 0:
-                    self._current_security_bars[security]["price"] = float(last_price_list[0][1])
-                    self._current_security_bars[security]["bid_price"] = float(last_price_list[0][2])
-                    self._current_security_bars[security]["bid_size"] = float(last_price_list[0][3])
-                    self._current_security_bars[security]["ask_price"] = float(last_price_list[0][4])
-                    self._current_security_bars[security]["ask_size"] = float(last_price_list[0][5])
-                else:
-                    # self._current_security_bars[security]["price"] = float("nan")
-                    self._current_security_bars[security]["bid_price"] = float("nan")
-                    self._current_security_bars[security]["bid_size"] = float("nan")
-                    self._current_security_bars[security]["ask_price"] = float("nan")
-                    self._current_security_bars[security]["ask_size"] = float("nan")
+                current_bars[security] = CurrentBar.from_bars(security_bars, fields)
 
+            current_bars[security].set_quote(self._latest_quotes([security.symbol]).get(security.symbol.upper()))
             if not field:
-                return self._current_security_bars[security].iloc[-1]
+                return current_bars[security].copy()
 
-            # log.info("security_bars(%s): %s" % (security.symbol, self._current_security_bars[security]))
-            return self._current_security_bars[security].iloc[-1][field]
+            # log.info("security_bars(%s): %s" % (security.symbol, current_bars[security]))
+            return current_bars[security][field]
 
         else:
-            symbol_list_map = {}
+            # the bars missing for any of the securities come in one history call, the quotes of all of them in one pass
+            missing = [sec for sec in security if not covers_window(_current_window(current_bars.get(sec)), 1, fields)]
+            if missing:
+                fields = _widen_current_fields([current_bars.get(sec) for sec in missing], fields)
+                missing_bars = self._fetch_current_bars(missing, since_last_quote_time, fields)
+                for sec in missing:
+                    current_bars[sec] = CurrentBar.from_bars(missing_bars.get(sec), fields)
+
+            last_quotes = self._latest_quotes([sec.symbol for sec in security])
             return_bars = {}
             for sec in security:
-                symbol_list_map[sec.symbol] = sec
-                if sec not in self._current_security_bars:
-                    security_bars = self.history(sec, bar_count=1, frequency=self._data_frequency, field=None, since_last_quote_time=since_last_quote_time)
-
-                    if security_bars is None:
-                        quote_date = datetime.now()
-                        quote_date = quote_date.replace(second=0, microsecond=0)
-                        security_bars = pd.DataFrame(index=pd.DatetimeIndex([quote_date]),
-                                                          data={'price': float("nan"),
-                                                                'open': float("nan"),
-                                                                'high': float("nan"),
-                                                                'low': float("nan"),
-                                                                'close': float("nan"),
-                                                                'volume': int(0)})
-
-                    self._current_security_bars[sec] = security_bars
-
-                if self._current_security_bars[sec] is not None:  # and (not self._current_security_bars[sec].empty or self._current_security_bars[sec].iloc[-1]["price"] == float["nan"]):
-                    last_price_list = self.rh_session.get_quote_list(sec.symbol, 'symbol,last_trade_price,bid_price,bid_size,ask_price,ask_size')
-                    if last_price_list and len(last_price_list) > 0:
-                        if sec in self._current_security_bars:
-                            self._current_security_bars[sec]["price"] = float(last_price_list[0][1])
-                            self._current_security_bars[sec]["bid_price"] = float(last_price_list[0][2])
-                            self._current_security_bars[sec]["bid_size"] = float(last_price_list[0][3])
-                            self._current_security_bars[sec]["ask_price"] = float(last_price_list[0][4])
-                            self._current_security_bars[sec]["ask_size"] = float(last_price_list[0][5])
-
+                current_bars[sec].set_quote(last_quotes.get(sec.symbol.upper()))
                 if not field:
-                    return_bars[sec] = self._current_security_bars[sec].iloc[-1]
-                return_bars[sec] = self._current_security_bars[sec].iloc[-1][field]
+                    return_bars[sec] = current_bars[sec].copy()
+                else:
+                    return_bars[sec] = current_bars[sec][field]
             return return_bars
 
+    def _fetch_current_bars(self, security, since_last_quote_time=None, fields=None):
+        # the latest bar straight from the quote source, after the wait for it: the history windows (and stale bars)
+        # may have been fetched earlier in the bar, before the source had it
+        symbol_map = security_to_symbol_map(security)
+        quotes = self.live_quote_source.fetch_quotes(symbol=list(symbol_map.keys()), bar_count=1, frequency=self._data_frequency, field=fields, market_open=self.is_market_open, since_last_quote_time=since_last_quote_time)
+        if not isinstance(security, Iterable):
+            return quotes[security.symbol]
+
+        return {symbol_map[sym]: quotes[sym] for sym in quotes}
+
+    def _latest_quotes(self, symbols):
+        # {SYMBOL: LatestQuote}, out of the polled quotes when fresh enough, asked (chunks in parallel) otherwise
+        if not self.quote_subscriptions.running:
+            return fetch_latest_quotes(self.rh_session, symbols, self.quote_executor)
+
+        quotes = {}
+        missing = []
+        for symbol in symbols:
+            quote = self.quote_subscriptions.latest(symbol, max_age=self.quote_max_age)
+            if quote is None:
+                missing.append(symbol)
+            else:
+                quotes[symbol.upper()] = quote
+
+        if missing:
+            quotes.update(fetch_latest_quotes(self.rh_session, missing, self.quote_executor))
+            # asked once, polled from now on
+            self.quote_subscriptions.subscribe(missing)
+
+        return quotes
+
+    def subscribe_quotes(self, security):
+        self.quote_subscriptions.subscribe([sec.symbol for sec in security] if isinstance(security, Iterable) else [security.symbol])
+
+    def unsubscribe_quotes(self, security):
+        self.quote_subscriptions.unsubscribe([sec.symbol for sec in security] if isinstance(security, Iterable) else [security.symbol])
+
+    def quote_subscription_stats(self):
+        return self.quote_subscriptions.stats()
+
+    def lock_stats(self):
+        # how often current() waited for another call on the same securities (stripes), and for how long
+        return self.security_locks.stats()
+
+    def history_stats(self):
+        # how many symbols data.history served fresh, stale (the last good bars) or missing (placeholder bars)
+        with self._history_outcome_lock:
+            return dict(self._history_outcomes)
+
+    def freshness_stats(self):
+        # waits of current() and the observed lag of each source, in seconds after the bar ended
+        return self.freshness.stats()
+
     def get_order(self, id):
         if not id:
             return
@@ -808,7 +908,11 @@ class FriarTuckLive:
                 symbol = instrument["symbol"]
                 security = self.fetch_and_build_security(symbol, sec_detail=instrument)
                 # last_price = self.current(security, field="price")
-                last_price = float(self.rh_session.last_trade_price(symbol)[0][0])
+                quote = self.quote_subscriptions.latest(symbol, max_age=self.quote_max_age)
+                if quote is not None and not np.isnan(quote.price):
+                    last_price = quote.price
+                else:
+                    last_price = float(self.rh_session.last_trade_price(symbol)[0][0])
                 log.debug(last_price)
                 # if not last_price:
                 # Lets try again
@@ -839,6 +943,9 @@ class FriarTuckLive:
                     unrealized_pl = unrealized_pl + ((cost_basis * np.abs([amount])[0]) - (last_price * np.abs([amount])[0]))
                     short_position_value = long_position_value + (cost_basis * np.abs([amount])[0])
 
+        # the held positions are valued out of the polled quotes
+        self.quote_subscriptions.set_subscriptions([security.symbol for security in positions], 'positions')
+
         pnl = equity-uncleared_deposits-yesterday_equity  # unrealized_pl + unsettled_funds
         leverage = 0
         net_leverage = 0
@@ -897,7 +1004,7 @@ def _set_trigger_timer(callback_function, minute_interval=None, direct_time=None
 
 
 def security_to_symbol_map(security):
-    if not isinstance(security, list):
+    if not isinstance(security, Iterable):
         return {security.symbol: security}
 
     symbols = {}
@@ -905,3 +1012,17 @@ def security_to_symbol_map(security):
         symbols[sec.symbol] = sec
 
     return symbols
+
+
+def _current_window(current_bar):
+    # a CurrentBar as the (bar_count, fields) window covers_window checks
+    return None if current_bar is None else (1, current_bar.fields)
+
+
+def _widen_current_fields(current_bars, fields):
+    # the columns to fetch again for these CurrentBars (None the ones not fetched yet): what they hold and fields
+    window = (1, fields)
+    for current_bar in current_bars:
+        if current_bar is not None:
+            window = widen_window(window, 1, current_bar.fields)
+    return window[1]
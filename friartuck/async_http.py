@@ -0,0 +1,188 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import ssl
+import urllib.request
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlparse
+
+from friartuck import http_client
+from friartuck.http_client import request_key
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class AsyncHTTPClient(object):
+    """Minimal HTTP/1.1 GET client for asyncio, keeping idle keep-alive connections per host for reuse.
+
+    Only what the quote sources need: GET, Content-Length or chunked bodies, redirects followed (up to MAX_REDIRECTS),
+    no compression, no authentication. Requests to hosts behind a proxy (http_proxy/https_proxy in the environment)
+    go through the blocking urllib client (http_client.get_content) on the loop's executor instead.
+    Identical requests in flight at the same time are sent once, every caller gets the same body.
+    """
+
+    def __init__(self, max_per_host=None, timeout=30):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self.calls = 0
+        self.shared = 0
+        self._in_flight = {}
+        self._idle = {}
+        self._semaphores = {}
+        self._ssl_context = ssl.create_default_context()
+
+    async def get_content(self, url):
+        key = request_key(url)
+        self.calls = self.calls + 1
+        if key in self._in_flight:
+            self.shared = self.shared + 1
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.ensure_future(self._get_content(url))
+        self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _get_content(self, url):
+        for redirect in range(MAX_REDIRECTS + 1):
+            parsed = urlparse(url)
+            if _proxied(parsed):
+                return await asyncio.get_event_loop().run_in_executor(None, http_client.get_content, url, self.timeout)
+
+            secure = parsed.scheme == 'https'
+            key = (parsed.hostname, parsed.port or (443 if secure else 80), secure)
+            path = parsed.path or '/'
+            if parsed.query:
+                path = "%s?%s" % (path, parsed.query)
+
+            semaphore = self._semaphore(key)
+            if semaphore is None:
+                status, reason, headers, body = await asyncio.wait_for(self._get(key, parsed.netloc, path), self.timeout)
+            else:
+                async with semaphore:
+                    status, reason, headers, body = await asyncio.wait_for(self._get(key, parsed.netloc, path), self.timeout)
+
+            if status in REDIRECT_STATUSES and 'location' in headers:
+                url = urljoin(url, headers['location'])
+                continue
+            if status >= 400:
+                raise HTTPError(url, status, reason, headers, None)
+
+            return body
+
+        raise HTTPError(url, status, "more than %s redirects" % MAX_REDIRECTS, headers, None)
+
+    async def _get(self, key, host, path):
+        # a reused connection may have been closed by the server in the meantime, retry once on a new one; the
+        # connection goes back to the idle ones only after a complete response, a failed or cancelled (timed out)
+        # request closes it
+        for attempt in range(2):
+            reader, writer, reused = await self._connection(key)
+            keep_alive = False
+            try:
+                status, reason, headers, body = await self._request(reader, writer, host, path)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if reused and attempt == 0:
+                    continue
+                raise
+            finally:
+                if keep_alive:
+                    self._idle.setdefault(key, []).append((reader, writer))
+                else:
+                    writer.close()
+
+            return status, reason, headers, body
+
+    async def _connection(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+
+        host, port, secure = key
+        reader, writer = await asyncio.open_connection(host, port, ssl=self._ssl_context if secure else None)
+        self.connections_opened = self.connections_opened + 1
+        return reader, writer, False
+
+    async def _request(self, reader, writer, host, path):
+        writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\nAccept: */*\r\nAccept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n" % (path, host)).encode('latin-1'))
+        await writer.drain()
+        self.requests_sent = self.requests_sent + 1
+
+        status_line = await reader.readuntil(b"\r\n")
+        parts = status_line.decode('latin-1').rstrip("\r\n").split(" ", 2)
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ''
+
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    # trailers end with an empty line
+                    while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            headers['connection'] = 'close'
+
+        return status, reason, headers, body
+
+    def _semaphore(self, key):
+        if not self.max_per_host:
+            return None
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.max_per_host)
+        return self._semaphores[key]
+
+    def close(self):
+        for connections in self._idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self._idle = {}
+
+
+def _proxied(parsed):
+    return parsed.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parsed.hostname)
@@ -0,0 +1,205 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from friartuck.async_http import AsyncHTTPClient
+from friartuck.quote_source import QuoteSourceAbstract, FriarTuckQuoteSource, RetrySchedule, intraday_outcome, fetch_fields, MISSING, _nan_bars, _has_intraday_answer
+
+log = logging.getLogger("friar_tuck")
+
+
+class AsyncFriarTuckQuoteSource(QuoteSourceAbstract):
+    """FriarTuckQuoteSource on asyncio: every symbol's intraday request is in flight at once from a single thread,
+    over keep-alive connections shared through one AsyncHTTPClient.
+
+    That is when the first of intraday_providers builds its requests itself (intraday_request/parse_intraday, as the
+    AlphaVantage adapter does) and neither routing nor hedge is on; otherwise each symbol goes through the providers,
+    routing and hedging of FriarTuckQuoteSource on the event loop's default executor.
+
+    The IEX history and daily bars mostly come out of the local bar stores once warmed up, they still go through
+    the blocking FriarTuckQuoteSource, run on the event loop's default executor.
+    """
+    allowed_history_frequency = FriarTuckQuoteSource.allowed_history_frequency
+
+    def __init__(self, config, quote_source=None):
+        self.config = config
+        self.quote_source = quote_source or FriarTuckQuoteSource(config)
+        self.http = AsyncHTTPClient(max_per_host=config.getint('QUOTE_SOURCE', 'max_per_host', fallback=0) or None,
+                                    timeout=config.getint('QUOTE_SOURCE', 'timeout', fallback=30))
+
+    @property
+    def alpha(self):
+        return self.quote_source.alpha
+
+    async def fetch_intraday_quotes(self, symbol, since_last_quote_time=None, frequency='1m', field=None, outcomes=None):
+        if frequency not in ['1m', '5m', '15m', '1h']:
+            log.warning("frequency used (%s) is not allowed, the allowable list includes (%s)" % (frequency, self.allowed_history_frequency))
+            return None
+
+        interval = "%smin" % self.allowed_history_frequency[frequency]
+        if isinstance(symbol, str):
+            bars = (await self._fetch_intraday_bars([symbol], interval, since_last_quote_time, wait_for_connection=True, outcomes=outcomes, fields=fetch_fields(field)))[symbol]
+            if field:
+                bars = bars[field]
+
+            return bars
+
+        wait_for_connection = 'yes' == self.config.get('ALPHA_VANTAGE', 'wait_for_connection')
+        symbol_bars = await self._fetch_intraday_bars(list(symbol), interval, since_last_quote_time, wait_for_connection, outcomes, fetch_fields(field))
+        if field:
+            for sym in symbol_bars:
+                symbol_bars[sym] = symbol_bars[sym][field]
+
+        return symbol_bars
+
+    async def _fetch_intraday_bars(self, symbols, interval, since_last_quote_time, wait_for_connection, outcomes=None, fields=None):
+        # same deferred retry queue as FriarTuckQuoteSource._fetch_intraday_bars, waiting without blocking the loop
+        async def fetch(sym):
+            bars = await self._get_quote_intraday(sym, interval, since_last_quote_time, fields)
+            log.info("connected:%s" % bars.iloc[0]['connected'])
+            return bars
+
+        symbol_bars = await self._gather_symbols(fetch, symbols)
+        retries = RetrySchedule(backoff=self.quote_source.retry_backoff, deadline=self.quote_source.retry_deadline)
+        if wait_for_connection:
+            for sym in symbols:
+                if intraday_outcome(symbol_bars[sym]) == MISSING:
+                    retries.defer(sym)
+
+        while len(retries) > 0:
+            await asyncio.sleep(retries.wait_time())
+            due = retries.pop_due()
+            if not due:
+                continue
+            log.info("got no quote for (%s), trying again" % due)
+            symbol_bars.update(await self._gather_symbols(fetch, due))
+            for sym in due:
+                if intraday_outcome(symbol_bars[sym]) == MISSING:
+                    retries.defer(sym)
+
+        if outcomes is not None:
+            for sym in symbols:
+                outcomes[sym] = intraday_outcome(symbol_bars[sym])
+
+        return symbol_bars
+
+    async def _get_quote_intraday(self, symbol, interval, since_last_quote_time, fields=None):
+        quote_source = self.quote_source
+        provider = quote_source.intraday_providers[0]
+        adapter = quote_source.adapters.get(provider)
+        if quote_source.routing or quote_source.hedge or not hasattr(adapter, 'intraday_request'):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, lambda: quote_source._fetch_intraday_bars([symbol], interval, since_last_quote_time, wait_for_connection=False, fields=fields)[symbol])
+
+        # timed and counted against the provider's circuit like the blocking source's calls
+        start = time.time()
+        try:
+            url, since_last_quote_time = adapter.intraday_request(symbol, since_last_quote_time, interval)
+            print(url)
+            content = await self.http.get_content(url)
+            data = json.loads(content.decode('utf-8'))
+            bars = adapter.parse_intraday(data, interval, since_last_quote_time, fields)
+        except Exception:
+            quote_source.router.record(provider, 'intraday', time.time() - start, ok=False)
+            raise
+
+        quote_source.router.record(provider, 'intraday', time.time() - start, ok=_has_intraday_answer(bars))
+        quote_source.freshness.record(provider, symbol, int(interval.replace("min", "")), bars)
+        return bars
+
+    async def fetch_quotes(self, symbol, bar_count=1, frequency='1m', field=None, market_open=True, since_last_quote_time=None, outcomes=None):
+        if frequency not in self.allowed_history_frequency:
+            log.warning("frequency used (%s) is not allowed, the allowable list includes (%s)" % (frequency, self.allowed_history_frequency))
+            return None
+
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        loop = asyncio.get_event_loop()
+        if self.quote_source.resample and frequency in ['5m', '15m', '1h']:
+            minute_bars = await self.fetch_quotes(symbol=symbols, bar_count=self.quote_source._resample_bar_count(bar_count, frequency), frequency='1m', field=fetch_fields(field), market_open=market_open, since_last_quote_time=since_last_quote_time, outcomes=outcomes)
+            symbol_bars = self.quote_source._resample_symbol_bars(minute_bars, bar_count=bar_count, frequency=frequency, field=field)
+        elif frequency in ['1m', '5m', '15m', '1h']:
+            symbol_bars = {}
+            if market_open:
+                interval = "%smin" % self.allowed_history_frequency[frequency]
+                symbol_bars = await self._fetch_intraday_bars(symbols, interval, since_last_quote_time, wait_for_connection=True, outcomes=outcomes, fields=fetch_fields(field))
+
+            symbol_bars = await loop.run_in_executor(None, lambda: self.quote_source._complete_intraday_bars(symbols=symbols, symbol_bars=symbol_bars, bar_count=bar_count, frequency=frequency, field=field))
+        else:
+            symbol_bars = await loop.run_in_executor(None, lambda: self.quote_source._fetch_daily_bars(symbols=symbols, bar_count=bar_count, field=field))
+
+        if isinstance(symbol, str):
+            return symbol_bars[symbol]
+
+        return symbol_bars
+
+    async def _gather_symbols(self, coroutine_function, symbols):
+        # {symbol: await coroutine_function(symbol)}, a failing symbol gets a NaN bar instead of failing the others
+        async def fetch(sym):
+            try:
+                return await coroutine_function(sym)
+            except Exception as e:
+                log.error("Error occurred while fetching quotes for (%s): %s " % (sym, e))
+                return _nan_bars()
+
+        results = await asyncio.gather(*[fetch(sym) for sym in symbols])
+        return dict(zip(symbols, results))
+
+    def close(self):
+        self.http.close()
+
+
+class SyncFriarTuckQuoteSource(QuoteSourceAbstract):
+    """Blocking facade over AsyncFriarTuckQuoteSource, a drop-in for FriarTuckQuoteSource.
+
+    The event loop runs forever in a daemon thread, callers from any thread block on the result of their coroutine.
+    """
+    allowed_history_frequency = FriarTuckQuoteSource.allowed_history_frequency
+
+    def __init__(self, config, quote_source=None):
+        self.async_source = AsyncFriarTuckQuoteSource(config, quote_source)
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self._run_loop, name="quote_source_loop", daemon=True)
+        self.loop_thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def fetch_intraday_quotes(self, symbol, since_last_quote_time=None, frequency='1m', field=None, outcomes=None):
+        return self._run(self.async_source.fetch_intraday_quotes(symbol=symbol, since_last_quote_time=since_last_quote_time, frequency=frequency, field=field, outcomes=outcomes))
+
+    def fetch_quotes(self, symbol, bar_count=1, frequency='1m', field=None, market_open=True, since_last_quote_time=None, outcomes=None):
+        return self._run(self.async_source.fetch_quotes(symbol=symbol, bar_count=bar_count, frequency=frequency, field=field, market_open=market_open, since_last_quote_time=since_last_quote_time, outcomes=outcomes))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.async_source.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,125 @@
+"""
+Compares the threaded FriarTuckQuoteSource with the asyncio engine on intraday quotes for many symbols, served by a
+local stand-in for AlphaVantage that answers every request after a fixed latency.
+
+    python -m friartuck.benchmark_async_quote_source --symbols 200 --latency 0.05 --max_workers 8
+"""
+import argparse
+import configparser
+import contextlib
+import io
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+from friartuck.async_quote_source import SyncFriarTuckQuoteSource
+from friartuck.quote_source import FriarTuckQuoteSource
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    latency = 0.0
+
+
+class AlphaVantageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        interval = parse_qs(urlparse(self.path).query)['interval'][0]
+        minutes = int(interval.replace("min", ""))
+        # AlphaVantage quotes US/Eastern time, one hour ahead of the local times friartuck uses
+        last_quote = datetime.now().replace(second=0, microsecond=0) + timedelta(hours=1)
+        quotes = {}
+        for i in range(30):
+            quote_date = last_quote - timedelta(minutes=i * minutes)
+            quotes[quote_date.strftime("%Y-%m-%d %H:%M:00")] = {'1. open': '10.0', '2. high': '10.5', '3. low': '9.5', '4. close': '10.2', '5. volume': '1000'}
+
+        body = json.dumps({"Time Series (%s)" % interval: quotes}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(latency):
+    server = StandInServer(('127.0.0.1', 0), AlphaVantageHandler)
+    server.latency = latency
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def build_config(concurrent_fetch, max_workers, max_per_host):
+    config = configparser.ConfigParser()
+    config.read_dict({'ALPHA_VANTAGE': {'apikey': 'demo', 'wait_for_connection': 'no'},
+                      'QUOTE_SOURCE': {'concurrent_fetch': 'yes' if concurrent_fetch else 'no',
+                                       'max_workers': str(max_workers),
+                                       'max_per_host': str(max_per_host)}})
+    return config
+
+
+def time_fetch(quote_source, symbols, since_last_quote_time, repeat):
+    timings = []
+    for _ in range(repeat):
+        # the adapters print every url, keep that out of the timings
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.time()
+            symbol_bars = quote_source.fetch_intraday_quotes(symbol=symbols, since_last_quote_time=since_last_quote_time, frequency='5m')
+            timings.append(time.time() - start)
+        assert len(symbol_bars) == len(symbols)
+
+    return min(timings)
+
+
+def main(symbol_count, latency, max_workers, max_per_host, repeat):
+    server = start_server(latency)
+    base_url = "http://127.0.0.1:%s" % server.server_address[1]
+    symbols = ["SYM%s" % i for i in range(symbol_count)]
+    since_last_quote_time = datetime.now().replace(second=0, microsecond=0) - timedelta(hours=1)
+
+    engines = []
+    for name, concurrent_fetch in [("sequential", False), ("threads(%s)" % max_workers, True)]:
+        quote_source = FriarTuckQuoteSource(build_config(concurrent_fetch, max_workers, max_per_host))
+        quote_source.alpha.base_url = base_url
+        engines.append((name, quote_source))
+
+    threaded_source = FriarTuckQuoteSource(build_config(False, max_workers, max_per_host))
+    threaded_source.alpha.base_url = base_url
+    async_source = SyncFriarTuckQuoteSource(threaded_source.config, threaded_source)
+    engines.append(("asyncio", async_source))
+
+    print("%s symbols, %sms latency, max_per_host %s" % (symbol_count, latency * 1000, max_per_host or "unlimited"))
+    print("%-14s %10s %14s" % ("engine", "total(s)", "symbols/s"))
+    for name, quote_source in engines:
+        total = time_fetch(quote_source, symbols, since_last_quote_time, repeat)
+        print("%-14s %10.3f %14.1f" % (name, total, symbol_count / total))
+
+    http = async_source.async_source.http
+    print("asyncio: %s requests over %s connections" % (http.requests_sent, http.connections_opened))
+    async_source.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=200,
+                        help="number of symbols fetched per run")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds the stand-in server waits before answering")
+    parser.add_argument("--max_workers", type=int, default=8,
+                        help="pool size of the threaded engine")
+    parser.add_argument("--max_per_host", type=int, default=0,
+                        help="requests in flight to the server (0 = no limit)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of timed runs, the best one is reported")
+    args = parser.parse_args()
+    main(args.symbols, args.latency, args.max_workers, args.max_per_host, args.repeat)
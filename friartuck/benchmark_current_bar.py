@@ -0,0 +1,87 @@
+"""
+Measures the per-call overhead data.current adds on top of the quotes, for 1 and 100 securities whose bars are
+already loaded: the one-row DataFrames current used to keep (quote columns assigned one at a time, .iloc[-1][field])
+against CurrentBar records. No network, the quotes are made up.
+
+    python -m friartuck.benchmark_current_bar --repeat 2000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from friartuck.current_bar import CurrentBar
+from friartuck.quote_source import BAR_FIELDS
+from friartuck.quote_subscriptions import LatestQuote
+
+
+def history_bar(random):
+    close = 100 + random.normal()
+    quote_date = datetime.now().replace(second=0, microsecond=0)
+    return pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=BAR_FIELDS,
+                        data={'price': [close], 'open': [close - 0.1], 'high': [close + 0.2], 'low': [close - 0.2], 'close': [close],
+                              'volume': [random.randint(100, 10000)], 'date': [quote_date]})
+
+
+def latest_quote(symbol, random):
+    price = 100 + random.normal()
+    return LatestQuote(symbol, price, price - 0.01, 100.0, price + 0.01, 200.0, datetime.now() - timedelta(seconds=2), datetime.now())
+
+
+def frame_current(security_bars, quotes, field):
+    # what current did per security before CurrentBar
+    return_bars = {}
+    for symbol, bars in security_bars.items():
+        quote = quotes[symbol]
+        bars["price"] = quote.price
+        bars["bid_price"] = quote.bid_price
+        bars["bid_size"] = quote.bid_size
+        bars["ask_price"] = quote.ask_price
+        bars["ask_size"] = quote.ask_size
+        bars["quote_age"] = (datetime.now() - quote.updated_at).total_seconds()
+        return_bars[symbol] = bars.iloc[-1] if not field else bars.iloc[-1][field]
+    return return_bars
+
+
+def record_current(security_bars, quotes, field):
+    return_bars = {}
+    for symbol, bar in security_bars.items():
+        bar.set_quote(quotes[symbol])
+        return_bars[symbol] = bar if not field else bar[field]
+    return return_bars
+
+
+def per_call(function, repeat):
+    # best of three runs, in microseconds per call
+    timings = []
+    for _ in range(3):
+        start = time.time()
+        for _ in range(repeat):
+            function()
+        timings.append((time.time() - start) / repeat)
+    return min(timings) * 10 ** 6
+
+
+def main(repeat):
+    random = np.random.RandomState(7)
+    print("%-10s %-16s %16s %16s %8s" % ("securities", "field", "frames(us/call)", "records(us/call)", "speedup"))
+    for security_count in [1, 100]:
+        symbols = ["SYM%s" % i for i in range(security_count)]
+        frames = {symbol: history_bar(random) for symbol in symbols}
+        records = {symbol: CurrentBar.from_bars(frames[symbol]) for symbol in symbols}
+        quotes = {symbol: latest_quote(symbol, random) for symbol in symbols}
+        calls = max(repeat // security_count, 5)
+        for field in ['price', ['close', 'price'], None]:
+            frame_time = per_call(lambda: frame_current(frames, quotes, field), calls)
+            record_time = per_call(lambda: record_current(records, quotes, field), calls)
+            print("%-10s %-16s %16.1f %16.1f %7.1fx" % (security_count, field, frame_time, record_time, frame_time / record_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000,
+                        help="calls timed for one security (divided by the number of securities for more)")
+    args = parser.parse_args()
+    main(args.repeat)
@@ -0,0 +1,125 @@
+"""
+Measures what asking history for a single field saves over building every column, on a wide universe served
+from local bar stores filled with synthetic minutes (no network): IEX intraday history, IEX daily history and
+the parsing of AlphaVantage intraday answers.
+
+    python -m friartuck.benchmark_field_projection --symbols 500 --days 5 --field close
+"""
+import argparse
+import contextlib
+import io
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from friartuck.alphavantage import alphavantage
+from friartuck.iextrading import iextrading
+from friartuck.quote_source import fetch_fields
+
+
+def session_dates(day_count):
+    dates = []
+    date = datetime.now().date() - timedelta(days=1)
+    while len(dates) < day_count:
+        if date.weekday() < 5:
+            dates.append(date)
+        date = date - timedelta(days=1)
+    return sorted(dates)
+
+
+def minute_columns(date, random):
+    # one record per minute of the session, 9:30 to 16:00 eastern, in the IEX store layout
+    minutes = np.arange(9 * 60 + 30, 16 * 60, dtype=np.int16)
+    closes = 100 + np.cumsum(random.normal(0, 0.05, len(minutes)))
+    columns = {'date': np.full(len(minutes), int(date.strftime("%Y%m%d")), dtype=np.int32),
+               'minute': minutes,
+               'flags': np.full(len(minutes), iextrading.HAS_CLOSE | iextrading.HAS_MARKET_CLOSE, dtype=np.uint8)}
+    for prefix in ['', 'market']:
+        for name, values in [('open', closes - 0.01), ('high', closes + 0.02), ('low', closes - 0.02), ('close', closes)]:
+            columns[prefix + name.capitalize() if prefix else name] = values
+        columns[prefix + 'Volume' if prefix else 'volume'] = random.randint(100, 10000, len(minutes)).astype(np.float64)
+    return columns
+
+
+def daily_columns(dates, random):
+    closes = 100 + np.cumsum(random.normal(0, 1, len(dates)))
+    return {'date': np.array([int(date.strftime("%Y%m%d")) for date in dates], dtype=np.int32),
+            'open': closes - 0.5, 'high': closes + 1, 'low': closes - 1, 'close': closes,
+            'volume': random.randint(10 ** 5, 10 ** 7, len(dates)).astype(np.int64)}
+
+
+def alphavantage_answer(minutes, random):
+    # AlphaVantage quotes US/Eastern time, one hour ahead of the local times friartuck uses
+    last_quote = datetime.now().replace(second=0, microsecond=0) + timedelta(hours=1)
+    closes = 100 + np.cumsum(random.normal(0, 0.05, minutes))
+    quotes = {}
+    for i in range(minutes):
+        quotes[(last_quote - timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:00")] = {
+            '1. open': "%.4f" % (closes[i] - 0.01), '2. high': "%.4f" % (closes[i] + 0.02), '3. low': "%.4f" % (closes[i] - 0.02),
+            '4. close': "%.4f" % closes[i], '5. volume': str(random.randint(100, 10000))}
+    return {"Time Series (1min)": quotes}
+
+
+def measure(function):
+    # best of three for the time, peak of python allocations of one more run
+    timings = []
+    for _ in range(3):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def main(symbol_count, day_count, minute_series, field):
+    random = np.random.RandomState(7)
+    store_dir = tempfile.mkdtemp(prefix="friartuck_projection_")
+    try:
+        iex = iextrading.IEXTrading(store_path="%s/iex_store" % store_dir, daily_store_path="%s/iex_daily" % store_dir, cache_bytes=0)
+        symbols = ["SYM%s" % i for i in range(symbol_count)]
+        dates = session_dates(day_count)
+        daily_dates = [date for date in session_dates(260) if int(date.strftime("%Y%m%d")) <= iextrading._last_session_date()]
+        for symbol in symbols:
+            for date in dates:
+                iex.bar_store.append_day(symbol, date, minute_columns(date, random))
+            iex.daily_store.replace(symbol, daily_columns(daily_dates, random))
+        answers = [alphavantage_answer(390, random) for _ in range(min(symbol_count, 50))]
+        since_last_quote_time = datetime.now().replace(second=0, microsecond=0) - timedelta(days=1)
+
+        fields = fetch_fields(field)
+        stages = [("iex intraday %sm" % minute_series, lambda fields: iex._get_bars_intraday_by_dates(symbols, minute_series, dates, fields)),
+                  ("iex daily", lambda fields: iex.get_quote_daily_batch(symbols, bars=250, fields=fields)),
+                  ("alphavantage parse", lambda fields: [alphavantage.intraday_bars(answer, "1min", since_last_quote_time, fields) for answer in answers])]
+
+        print("%s symbols, %s days, field %s (builds %s)" % (symbol_count, day_count, field, fields))
+        print("%-22s %12s %12s %14s %14s" % ("stage", "all(s)", "field(s)", "all(peak MB)", "field(peak MB)"))
+        for name, stage in stages:
+            # the adapters print as they go, keep that out of the timings
+            with contextlib.redirect_stdout(io.StringIO()):
+                all_time, all_peak = measure(lambda: stage(None))
+                field_time, field_peak = measure(lambda: stage(fields))
+            print("%-22s %12.3f %12.3f %14.1f %14.1f" % (name, all_time, field_time, all_peak / 2.0 ** 20, field_peak / 2.0 ** 20))
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=500,
+                        help="number of symbols in the universe")
+    parser.add_argument("--days", type=int, default=5,
+                        help="number of stored days of minutes per symbol")
+    parser.add_argument("--minute_series", type=int, default=5,
+                        help="bar size of the intraday history (1, 5, 15, 30, 60)")
+    parser.add_argument("--field", default='close',
+                        help="field asked for instead of every column")
+    args = parser.parse_args()
+    main(args.symbols, args.days, args.minute_series, args.field)
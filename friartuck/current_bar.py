@@ -0,0 +1,105 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from datetime import datetime
+
+import pandas as pd
+
+BAR_RECORD_FIELDS = ('price', 'open', 'high', 'low', 'close', 'volume', 'date', 'bid_price', 'bid_size', 'ask_price', 'ask_size', 'quote_age')
+
+
+class CurrentBar(object):
+    """The current bar of one security for data.current: the last history bar and the latest quote.
+
+    bar['price'] (or bar.price) is the value, bar[['price', 'volume']] a Series of those fields, to_series() all of
+    them; time is the bar's time (the name of the Series). fields are the bar columns it was built from (None: all).
+    """
+    __slots__ = ('time', 'fields') + BAR_RECORD_FIELDS
+
+    def __init__(self, time, price=float("nan"), open=float("nan"), high=float("nan"), low=float("nan"), close=float("nan"), volume=0, date=None):
+        self.time = time
+        self.fields = None
+        self.price = price
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.date = date
+        self.bid_price = float("nan")
+        self.bid_size = float("nan")
+        self.ask_price = float("nan")
+        self.ask_size = float("nan")
+        self.quote_age = float("nan")
+
+    @classmethod
+    def from_bars(cls, bars, fields=None):
+        """The last bar of a history frame fetched with fields, a NaN bar of the current minute when there is none."""
+        if bars is None or len(bars) == 0:
+            bar = cls(datetime.now().replace(second=0, microsecond=0))
+        else:
+            row = bars.values[-1]
+            values = {name: row[position] for position, name in enumerate(bars.columns) if name in BAR_RECORD_FIELDS}
+            bar = cls(bars.index[-1], **values)
+        bar.fields = fields
+        return bar
+
+    def set_quote(self, quote):
+        # quote: a LatestQuote, None when Robinhood had none (the bar's price stays)
+        if quote is None:
+            self.bid_price = self.bid_size = self.ask_price = self.ask_size = self.quote_age = float("nan")
+            return
+
+        self.price = quote.price
+        self.bid_price = quote.bid_price
+        self.bid_size = quote.bid_size
+        self.ask_price = quote.ask_price
+        self.ask_size = quote.ask_size
+        self.quote_age = (datetime.now() - quote.updated_at).total_seconds() if quote.updated_at else float("nan")
+
+    def copy(self):
+        bar = CurrentBar(self.time)
+        bar.fields = self.fields
+        for name in BAR_RECORD_FIELDS:
+            setattr(bar, name, getattr(self, name))
+        return bar
+
+    def __getitem__(self, field):
+        if isinstance(field, str):
+            if field not in BAR_RECORD_FIELDS:
+                raise KeyError(field)
+            return getattr(self, field)
+        return pd.Series([self[name] for name in field], index=list(field), name=self.time)
+
+    def get(self, field, default=None):
+        return getattr(self, field) if field in BAR_RECORD_FIELDS else default
+
+    def keys(self):
+        return list(BAR_RECORD_FIELDS)
+
+    def to_series(self):
+        return self[BAR_RECORD_FIELDS]
+
+    def __repr__(self):
+        return "CurrentBar(%s, %s)" % (self.time, ", ".join("%s=%s" % (name, getattr(self, name)) for name in BAR_RECORD_FIELDS))
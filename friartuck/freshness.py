@@ -0,0 +1,230 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from friartuck.latency_stats import LatencyStats
+
+log = logging.getLogger("friar_tuck")
+
+# bar length in minutes of the intraday frequencies, daily bars are not waited for
+INTRADAY_MINUTES = {'1m': 1, '5m': 5, '15m': 15, '1h': 60}
+
+
+class FreshnessTracker(object):
+    """When the latest bar of each symbol became available, per source.
+
+    Every intraday answer is recorded. A bar is ready once any answer holds it; the seconds between the end of a bar
+    and the first answer holding it are a lag sample of the source, but only when the source was asked after the bar
+    ended and did not have it yet (otherwise the answer only says how late it was asked).
+
+    The probe (start_probe) asks for the watched symbols from each bar boundary of the session on, every probe_interval
+    seconds until they all have the new bar, which marks them ready as soon as the source publishes and gives the lag
+    samples. It asks for no more than calls_per_minute symbols a minute (0 = no limit), a symbol is watched while
+    current() asked for it within the last two bars, and a boundary the bars did not come in for skips the next 1, 3,
+    7... (at most max_backoff) boundaries.
+    wait_ready() blocks until every symbol has the bar that ended on the last boundary, but no longer than the boundary
+    plus the expected lag (the percentile of the recent samples of the quickest source, default_lag until min_samples
+    are in, at most max_wait).
+    """
+
+    def __init__(self, default_lag=10, max_wait=10, percentile=90, min_samples=5, window=200, probe_interval=1, calls_per_minute=5, max_backoff=15):
+        self.default_lag = default_lag
+        self.max_wait = max_wait
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.probe_interval = probe_interval
+        self.calls_per_minute = calls_per_minute
+        self.max_backoff = max_backoff
+        self.lags = LatencyStats(window=window)
+        self.counts = {'ready': 0, 'waited': 0, 'timed_out': 0, 'wait_seconds': 0.0, 'probes': 0, 'probe_calls': 0, 'probe_misses': 0}
+        # (source, symbol, minute_series) -> start of the latest bar and time of the latest answer,
+        # symbol -> end of its latest bar (any source)
+        self._latest = {}
+        self._asked = {}
+        self._ready = {}
+        # symbol -> last time current() asked for it, times of the probe's calls within the last minute
+        self._watched = {}
+        self._calls = deque()
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._probe = None
+
+    def record(self, source, symbol, minute_series, bars, seen_at=None):
+        seen_at = seen_at or datetime.now()
+        key = (source, symbol, minute_series)
+        valid = None
+        if bars is not None and len(bars) > 0 and 'close' in bars:
+            valid = ~np.isnan(bars['close'].values.astype(np.float64))
+        if valid is None or not valid.any():
+            with self._condition:
+                self._asked[key] = seen_at
+            return
+
+        bar_start = pd.Timestamp(bars.index.values[valid].max()).to_pydatetime()
+        bar_end = bar_start + timedelta(minutes=minute_series)
+        with self._condition:
+            previous = self._latest.get(key)
+            asked = self._asked.get(key)
+            self._asked[key] = seen_at
+            if previous is None or bar_start > previous:
+                self._latest[key] = bar_start
+                # a sample only when the previous answer came after the bar ended without it
+                if previous is not None and asked is not None and asked >= bar_end:
+                    self.lags.record(source, (seen_at - bar_end).total_seconds())
+            if bar_end > self._ready.get(symbol, datetime.min):
+                self._ready[symbol] = bar_end
+                self._condition.notify_all()
+
+    def watch(self, symbols):
+        # symbols the probe asks for from the next boundary on
+        now = datetime.now()
+        with self._condition:
+            for symbol in symbols:
+                self._watched[symbol] = now
+
+    @property
+    def probing(self):
+        return self._probe is not None and self._probe.is_alive()
+
+    def start_probe(self, fetch, minute_series, is_open=None):
+        """Probes the watched symbols from every boundary of minute_series bars on, fetch(symbols, since_last_quote_time)
+        asks the quote source for their bars (which records them). Boundaries is_open() is False on (the market is
+        closed) are skipped."""
+        if self.probing:
+            return
+        self._stop.clear()
+        self._probe = threading.Thread(target=self._run_probe, args=(fetch, minute_series, is_open), name='freshness_probe')
+        self._probe.setDaemon(True)
+        self._probe.start()
+
+    def stop_probe(self):
+        self._stop.set()
+
+    def _run_probe(self, fetch, minute_series, is_open):
+        misses = 0
+        skip = 0
+        while not self._stop.is_set():
+            now = datetime.now()
+            boundary = last_boundary(now, minute_series) + timedelta(minutes=minute_series)
+            if self._stop.wait((boundary - now).total_seconds()):
+                return
+
+            if is_open is not None and not is_open():
+                misses = skip = 0
+                continue
+            if skip:
+                skip = skip - 1
+                continue
+
+            with self._condition:
+                for symbol in [symbol for symbol, asked in self._watched.items() if asked < boundary - timedelta(minutes=2 * minute_series)]:
+                    self._watched.pop(symbol)
+
+            # the bar before the one that just ended is enough for the answer to say whether the new one is in
+            since_last_quote_time = boundary - timedelta(minutes=2 * minute_series)
+            missing = []
+            while datetime.now() < boundary + timedelta(seconds=self.max_wait):
+                with self._condition:
+                    missing = sorted(symbol for symbol in self._watched if self._ready.get(symbol, datetime.min) < boundary)
+                    probed = self._take_calls(missing)
+                if not missing:
+                    break
+                if probed:
+                    try:
+                        fetch(probed, since_last_quote_time)
+                    except Exception as e:
+                        log.error("Error occurred while probing the bars of (%s): %s " % (probed, e))
+                if self._stop.wait(self.probe_interval):
+                    return
+
+            if missing:
+                # the source did not publish (or the symbols did not trade), back off instead of asking every bar
+                misses = misses + 1
+                skip = min(2 ** misses - 1, self.max_backoff)
+                with self._condition:
+                    self.counts['probe_misses'] = self.counts['probe_misses'] + 1
+            else:
+                misses = 0
+
+    def _take_calls(self, symbols):
+        # called with the lock held: the symbols the rate limit lets the probe ask for now
+        now = datetime.now()
+        while self._calls and self._calls[0] <= now - timedelta(minutes=1):
+            self._calls.popleft()
+        if self.calls_per_minute:
+            symbols = symbols[:max(self.calls_per_minute - len(self._calls), 0)]
+        if symbols:
+            self._calls.extend([now] * len(symbols))
+            self.counts['probes'] = self.counts['probes'] + 1
+            self.counts['probe_calls'] = self.counts['probe_calls'] + len(symbols)
+        return symbols
+
+    def expected_lag(self):
+        lags = [self.lags.percentile(source, self.percentile) for source in self.lags.stats() if self.lags.count(source) >= self.min_samples]
+        return min(min(lags) if lags else self.default_lag, self.max_wait)
+
+    def wait_ready(self, symbols, minute_series, now=None):
+        """Waits until each symbol has the bar ending on the last boundary of minute_series bars, True when they
+        all do (right away if they already did), False when the expected lag ran out first."""
+        now = now or datetime.now()
+        boundary = last_boundary(now, minute_series)
+        deadline = boundary + timedelta(seconds=self.expected_lag())
+        started = datetime.now()
+        waits = 0
+        with self._condition:
+            while True:
+                missing = [symbol for symbol in symbols if self._ready.get(symbol, datetime.min) < boundary]
+                remaining = (deadline - datetime.now()).total_seconds()
+                if not missing or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+                waits = waits + 1
+
+            if missing:
+                self.counts['timed_out'] = self.counts['timed_out'] + 1
+            else:
+                self.counts['waited' if waits else 'ready'] = self.counts['waited' if waits else 'ready'] + 1
+            self.counts['wait_seconds'] = self.counts['wait_seconds'] + (datetime.now() - started).total_seconds()
+
+        return not missing
+
+    def stats(self):
+        with self._condition:
+            counts = dict(self.counts)
+        return dict(counts, expected_lag=self.expected_lag(), lag=self.lags.stats())
+
+
+def last_boundary(now, minute_series):
+    # intraday bars end every bar length from midnight on, like the interval processor runs: every 1/5/15 minutes (the
+    # session open is one of them) and on the clock hours
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = int((now - midnight).total_seconds() // 60)
+    return midnight + timedelta(minutes=(elapsed // minute_series) * minute_series)
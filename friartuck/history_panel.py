@@ -0,0 +1,83 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+import pandas as pd
+
+# numeric bar columns a panel can hold
+PANEL_FIELDS = ['price', 'open', 'high', 'low', 'close', 'volume']
+
+
+class HistoryPanel(object):
+    """Multi-symbol history aligned on one time axis: values is a (time x symbol x field) float ndarray, NaN where a
+    symbol has no bar at that time.
+
+    panel['close'] is a (time x symbol) DataFrame, to_frame() a DataFrame with (symbol, field) MultiIndex columns,
+    both are views on values.
+    """
+
+    def __init__(self, values, times, securities, fields):
+        self.values = values
+        self.times = times
+        self.securities = securities
+        self.symbols = [security.symbol for security in securities]
+        self.fields = fields
+
+    def __getitem__(self, field):
+        return pd.DataFrame(self.values[:, :, self.fields.index(field)], index=self.times, columns=self.symbols, copy=False)
+
+    def to_frame(self):
+        columns = pd.MultiIndex.from_product([self.symbols, self.fields], names=['symbol', 'field'])
+        return pd.DataFrame(self.values.reshape(len(self.times), -1), index=self.times, columns=columns, copy=False)
+
+    def __str__(self):
+        return "HistoryPanel(%s times x %s symbols x %s fields)" % self.values.shape
+
+
+def panel_fields(field):
+    """The panel fields for a history field (a name, a list of names or None for every numeric column)."""
+    if not field:
+        return list(PANEL_FIELDS)
+    fields = [field] if isinstance(field, str) else list(field)
+    return [name for name in PANEL_FIELDS if name in fields]
+
+
+def build_panel(symbol_bars, securities, fields):
+    """Aligns {symbol: bars} into a HistoryPanel of securities (in that order) x fields, filling one preallocated
+    array; the NaN placeholder bar of a symbol without quotes is left out of the time axis."""
+    closes = {}
+    for security in securities:
+        bars = symbol_bars[security.symbol]
+        closes[security.symbol] = ~np.isnan(bars['close'].values.astype(np.float64))
+
+    times = np.unique(np.concatenate([symbol_bars[security.symbol].index.values[closes[security.symbol]] for security in securities] +
+                                     [np.array([], dtype='datetime64[ns]')]))
+    values = np.full((len(times), len(securities), len(fields)), np.nan)
+    for position, security in enumerate(securities):
+        bars = symbol_bars[security.symbol]
+        valid = closes[security.symbol]
+        rows = np.searchsorted(times, bars.index.values[valid])
+        values[rows, position, :] = bars[fields].values[valid].astype(np.float64)
+
+    return HistoryPanel(values, pd.DatetimeIndex(times), securities, fields)
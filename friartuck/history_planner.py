@@ -0,0 +1,148 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import threading
+
+from friartuck.quote_source import fetch_fields, FRESH
+
+log = logging.getLogger("friar_tuck")
+
+
+class HistoryPlanner(object):
+    """Serves data.history calls of the current bar out of one window per (symbol, frequency).
+
+    A window is fetched with the fields and the widest bar_count asked so far, narrower requests are slices of it.
+    Each window keeps the outcome (FRESH | STALE | MISSING) the quote source reported for it.
+    Calls made while a fetch for the same frequency is in flight are merged into the next single upstream fetch.
+    """
+
+    def __init__(self, quote_source):
+        self.quote_source = quote_source
+        self.fetches = 0
+        self.served = 0
+        self._bar_time = None
+        self._windows = {}
+        self._errors = {}
+        self._pending = {}
+        self._in_flight = {}
+        self._leaders = set()
+        self._lock = threading.Condition()
+
+    def fetch(self, symbols, bar_count=1, frequency='1d', field=None, market_open=True, bar_time=None, outcomes=None):
+        """{symbol: bars} like quote_source.fetch_quotes, bar_time identifies the current bar (windows are dropped when
+        it changes). outcomes, when given, is filled with {symbol: FRESH | STALE | MISSING}."""
+        if frequency not in self.quote_source.allowed_history_frequency:
+            return self.quote_source.fetch_quotes(symbol=symbols, bar_count=bar_count, frequency=frequency, field=field, market_open=market_open, outcomes=outcomes)
+
+        with self._lock:
+            if bar_time != self._bar_time:
+                self._bar_time = bar_time
+                self._windows = {}
+                self._errors = {}
+
+            # symbols without a wide enough window, either already in flight or to fetch in the next round
+            fields = fetch_fields(field)
+            in_flight = self._in_flight.get(frequency, {})
+            waiting = [symbol for symbol in symbols if not covers_window(self._windows.get((symbol, frequency)), bar_count, fields)]
+            if waiting:
+                for symbol in waiting:
+                    if not covers_window(in_flight.get(symbol), bar_count, fields):
+                        pending = self._pending.setdefault(frequency, {})
+                        # the new window also keeps what the current one holds
+                        window = pending.get(symbol) or self._windows.get((symbol, frequency))
+                        pending[symbol] = widen_window(window, bar_count, fields)
+
+                if frequency in self._leaders:
+                    # a fetch is in flight, the next round of the leader picks these symbols up
+                    while frequency in self._leaders:
+                        self._lock.wait()
+                else:
+                    self._lead(frequency, market_open)
+
+            self.served = self.served + 1
+            symbol_bars = {}
+            for symbol in symbols:
+                if (symbol, frequency) not in self._windows:
+                    raise self._errors.get((symbol, frequency), KeyError(symbol))
+                bars = self._windows[(symbol, frequency)][2].tail(bar_count)
+                symbol_bars[symbol] = bars[field] if field else bars.copy()
+                if outcomes is not None:
+                    outcomes[symbol] = self._windows[(symbol, frequency)][3]
+
+            return symbol_bars
+
+    def _lead(self, frequency, market_open):
+        # called with the lock held, fetches rounds of pending symbols until no more come in
+        self._leaders.add(frequency)
+        try:
+            while self._pending.get(frequency):
+                pending = self._pending.pop(frequency)
+                bar_count = max(window[0] for window in pending.values())
+                fields = None
+                if all(window[1] is not None for window in pending.values()):
+                    fields = fetch_fields(sorted(set(name for window in pending.values() for name in window[1])))
+                symbols = list(pending)
+                self._in_flight[frequency] = {symbol: (bar_count, fields) for symbol in symbols}
+                self._lock.release()
+                fetch_outcomes = {}
+                try:
+                    self.fetches = self.fetches + 1
+                    symbol_bars = self.quote_source.fetch_quotes(symbol=symbols, bar_count=bar_count, frequency=frequency, field=fields, market_open=market_open, outcomes=fetch_outcomes)
+                    error = None
+                except Exception as e:
+                    log.error("Error occurred while fetching history for (%s): %s " % (symbols, e))
+                    symbol_bars = {}
+                    error = e
+                finally:
+                    self._lock.acquire()
+
+                for symbol in symbols:
+                    if symbol in symbol_bars:
+                        self._windows[(symbol, frequency)] = (bar_count, fields, symbol_bars[symbol], fetch_outcomes.get(symbol, FRESH))
+                        self._errors.pop((symbol, frequency), None)
+                    else:
+                        self._errors[(symbol, frequency)] = error or KeyError(symbol)
+        finally:
+            self._in_flight.pop(frequency, None)
+            self._leaders.discard(frequency)
+            self._lock.notify_all()
+
+    def stats(self):
+        return {'fetches': self.fetches, 'served': self.served, 'windows': len(self._windows)}
+
+
+def covers_window(window, bar_count, fields):
+    # window is (bar_count, fields, ...), fields None meaning every column
+    if window is None or window[0] < bar_count:
+        return False
+    return window[1] is None or (fields is not None and set(fields) <= set(window[1]))
+
+
+def widen_window(window, bar_count, fields):
+    if window is None:
+        return bar_count, fields
+    if window[1] is None or fields is None:
+        return max(window[0], bar_count), None
+    return max(window[0], bar_count), fetch_fields(sorted(set(window[1]) | set(fields)))
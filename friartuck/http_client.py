@@ -0,0 +1,149 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import threading
+import urllib.request
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+
+class HostLimiter(object):
+    """Caps the number of requests in flight per host, whatever thread pool they come from."""
+
+    def __init__(self, max_per_host=None, host_limits=None):
+        # max_per_host=None means unlimited, host_limits overrides the cap for specific hosts
+        self.max_per_host = max_per_host
+        self.host_limits = host_limits or {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def limit(self, url):
+        semaphore = self._semaphore(urlparse(url).netloc)
+        if semaphore is None:
+            yield
+            return
+
+        with semaphore:
+            yield
+
+    def _semaphore(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                max_requests = self.host_limits.get(host, self.max_per_host)
+                self._semaphores[host] = threading.BoundedSemaphore(max_requests) if max_requests else None
+
+            return self._semaphores[host]
+
+
+class SingleFlight(object):
+    """Concurrent calls with the same key share one in-flight call: the first caller runs it, the others wait for
+    its result (or its exception). Nothing is kept once the call is done."""
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            self.calls = self.calls + 1
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+            else:
+                self.shared = self.shared + 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared, 'in_flight': len(self._in_flight)}
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def request_key(url, params=None, identity=None):
+    """Normalized identity of a GET request: scheme and host lower-cased, query parameters (and params) sorted.
+
+    identity tells apart the callers whose responses must not be shared, e.g. the session an authenticated request is
+    sent with.
+    """
+    parsed = urlparse(url)
+    query = parse_qsl(parsed.query) + sorted((params or {}).items())
+    key = "%s://%s%s?%s" % (parsed.scheme.lower(), parsed.netloc.lower(), parsed.path, urlencode(sorted(query)))
+    if identity is not None:
+        key = "%s#%s" % (key, identity)
+    return key
+
+
+limiter = HostLimiter()
+single_flight = SingleFlight()
+# seconds a request may take before urlopen gives up on it (None = wait forever)
+default_timeout = None
+
+
+def configure(max_per_host=None, host_limits=None, timeout=None):
+    global limiter, default_timeout
+    limiter = HostLimiter(max_per_host, host_limits)
+    default_timeout = timeout
+
+
+def get_content(url, timeout=None):
+    # identical requests in flight at the same time, from any thread, are sent once
+    timeout = default_timeout if timeout is None else timeout
+    return single_flight.do(request_key(url), lambda: _get_content(url, timeout))
+
+
+def _get_content(url, timeout=None):
+    with limiter.limit(url):
+        if timeout is None:
+            response = urllib.request.urlopen(url)
+        else:
+            response = urllib.request.urlopen(url, timeout=timeout)
+        with response:
+            return response.read()
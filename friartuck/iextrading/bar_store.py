@@ -0,0 +1,310 @@
+"""
+Columnar, memory-mapped store for raw IEX minute records.
+
+Each symbol gets a directory holding one flat binary file per field (iextrading.STORE_COLUMNS) plus an index file with one
+(date, start, count) record per stored trading day. Days are only ever appended: the column files are written
+first and the index record last, so a day becomes visible once it is complete. Reads are numpy memmap slices,
+no parsing and no copy.
+
+DailyBarStore keeps the daily bars of each symbol the same way, in date order, so only the missing tail
+needs to be downloaded.
+
+Existing TinyDB files (data/iex_db_<SYMBOL>.json) can be migrated once with:
+
+    python -m friartuck.iextrading.bar_store --data_dir data --store_dir data/iex_store
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('date', '<i4'), ('start', '<i8'), ('count', '<i4')])
+INDEX_FILE = 'index.bin'
+# days a source answered without quotes for, and when (seconds since the epoch)
+EMPTY_DTYPE = np.dtype([('date', '<i4'), ('seen_at', '<i8')])
+EMPTY_FILE = 'empty.bin'
+
+
+class IntradayBarStore(object):
+    def __init__(self, columns, path='data/iex_store'):
+        # columns: OrderedDict of column name -> numpy dtype, every day appended must provide all of them
+        self.columns = columns
+        self.path = path
+        self._lock = threading.RLock()
+        self._indexes = {}
+        self._columns = {}
+        self._empty_days = {}
+
+    def symbols(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if os.path.isfile(os.path.join(self.path, name, INDEX_FILE)))
+
+    def dates(self, symbol):
+        return sorted(self._index(symbol))
+
+    def has_day(self, symbol, date):
+        return _date_key(date) in self._index(symbol)
+
+    def read_day(self, symbol, date):
+        with self._lock:
+            index = self._index(symbol)
+            date_key = _date_key(date)
+            if date_key not in index:
+                return None
+
+            start, count = index[date_key]
+            return {name: values[start:start + count] for name, values in self._mapped_columns(symbol).items()}
+
+    def read_range(self, symbol, from_date, to_date):
+        """Returns the records of every stored day within [from_date, to_date], in date order.
+
+        Days appended in date order are adjacent on disk and come back as a single zero-copy slice.
+        """
+        with self._lock:
+            index = self._index(symbol)
+            days = [index[date_key] for date_key in sorted(index) if _date_key(from_date) <= date_key <= _date_key(to_date)]
+            if not days:
+                return None
+
+            columns = self._mapped_columns(symbol)
+            contiguous = all(days[i][0] == days[i - 1][0] + days[i - 1][1] for i in range(1, len(days)))
+            if contiguous:
+                start = days[0][0]
+                end = days[-1][0] + days[-1][1]
+                return {name: values[start:end] for name, values in columns.items()}
+
+            return {name: np.concatenate([values[start:start + count] for start, count in days]) for name, values in columns.items()}
+
+    def append_day(self, symbol, date, columns):
+        date_key = _date_key(date)
+        with self._lock:
+            index = self._index(symbol)
+            if date_key in index:
+                return False
+
+            symbol_path = self._symbol_path(symbol)
+            if not os.path.isdir(symbol_path):
+                os.makedirs(symbol_path)
+
+            # anything past the last indexed day is left over from an interrupted append
+            length = max([start + count for start, count in index.values()] or [0])
+            count = len(columns['date'])
+            for name, dtype in self.columns.items():
+                column_file = os.path.join(symbol_path, '%s.bin' % name)
+                with open(column_file, 'ab') as file:
+                    file.truncate(length * dtype.itemsize)
+                    file.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+            record = np.array([(date_key, length, count)], dtype=INDEX_DTYPE)
+            with open(os.path.join(symbol_path, INDEX_FILE), 'ab') as file:
+                file.write(record.tobytes())
+
+            index[date_key] = (length, count)
+            self._columns.pop(symbol.upper(), None)
+            return True
+
+    def mark_empty_day(self, symbol, date):
+        """Records that date had no quotes for symbol (a holiday, or the source failing), see is_empty_day."""
+        date_key = _date_key(date)
+        seen_at = int(time.time())
+        with self._lock:
+            empty_days = self._empty(symbol)
+            symbol_path = self._symbol_path(symbol)
+            if not os.path.isdir(symbol_path):
+                os.makedirs(symbol_path)
+
+            record = np.array([(date_key, seen_at)], dtype=EMPTY_DTYPE)
+            with open(os.path.join(symbol_path, EMPTY_FILE), 'ab') as file:
+                file.write(record.tobytes())
+            empty_days[date_key] = seen_at
+
+    def is_empty_day(self, symbol, date, max_age):
+        # marked empty within the last max_age seconds, an older mark is asked for again
+        seen_at = self._empty(symbol).get(_date_key(date))
+        return seen_at is not None and time.time() - seen_at < max_age
+
+    def _empty(self, symbol):
+        symbol = symbol.upper()
+        with self._lock:
+            if symbol not in self._empty_days:
+                empty_days = {}
+                empty_file = os.path.join(self._symbol_path(symbol), EMPTY_FILE)
+                if os.path.isfile(empty_file):
+                    for record in np.fromfile(empty_file, dtype=EMPTY_DTYPE):
+                        empty_days[int(record['date'])] = int(record['seen_at'])
+                self._empty_days[symbol] = empty_days
+
+            return self._empty_days[symbol]
+
+    def _symbol_path(self, symbol):
+        return os.path.join(self.path, symbol.upper())
+
+    def _index(self, symbol):
+        symbol = symbol.upper()
+        with self._lock:
+            if symbol not in self._indexes:
+                index = {}
+                index_file = os.path.join(self._symbol_path(symbol), INDEX_FILE)
+                if os.path.isfile(index_file):
+                    records = np.fromfile(index_file, dtype=INDEX_DTYPE)
+                    # a torn trailing record is ignored by fromfile, the day gets fetched again
+                    for record in records:
+                        index[int(record['date'])] = (int(record['start']), int(record['count']))
+                self._indexes[symbol] = index
+
+            return self._indexes[symbol]
+
+    def _mapped_columns(self, symbol):
+        symbol = symbol.upper()
+        if symbol not in self._columns:
+            columns = {}
+            for name, dtype in self.columns.items():
+                column_file = os.path.join(self._symbol_path(symbol), '%s.bin' % name)
+                if os.path.getsize(column_file) == 0:
+                    columns[name] = np.zeros(0, dtype=dtype)
+                else:
+                    columns[name] = np.memmap(column_file, dtype=dtype, mode='r')
+            self._columns[symbol] = columns
+
+        return self._columns[symbol]
+
+
+class DailyBarStore(object):
+    """Per-symbol daily bars kept in date order, one flat binary file per column (iextrading.DAILY_COLUMNS).
+
+    New days are appended to the tail; the 'date' column is written last and its length is the number of
+    committed rows, anything past it in the other columns is left over from an interrupted append.
+    """
+    def __init__(self, columns, path='data/iex_daily'):
+        self.columns = columns
+        self.path = path
+        self._lock = threading.RLock()
+        self._columns = {}
+
+    def read(self, symbol):
+        symbol = symbol.upper()
+        with self._lock:
+            if symbol not in self._columns:
+                columns = {}
+                length = self._length(symbol)
+                for name, dtype in self.columns.items():
+                    column_file = self._column_file(symbol, name)
+                    if length == 0:
+                        columns[name] = np.zeros(0, dtype=dtype)
+                    else:
+                        columns[name] = np.memmap(column_file, dtype=dtype, mode='r', shape=(length,))
+                self._columns[symbol] = columns
+
+            return self._columns[symbol]
+
+    def last_date(self, symbol):
+        dates = self.read(symbol)['date']
+        if len(dates) == 0:
+            return None
+        return int(dates[-1])
+
+    def append(self, symbol, columns):
+        """Appends the rows dated after the last stored day, returns the number of rows added."""
+        with self._lock:
+            last_date = self.last_date(symbol)
+            newer = np.ones(len(columns['date']), dtype=bool) if last_date is None else np.asarray(columns['date']) > last_date
+            if not newer.any():
+                return 0
+
+            self._write(symbol, {name: np.asarray(values)[newer] for name, values in columns.items()}, self._length(symbol))
+            return int(newer.sum())
+
+    def replace(self, symbol, columns):
+        # every column is written to a new file moved over the old one (date last): maps handed out by read() keep
+        # the old file, truncating it under them could fault or tear their reads
+        symbol = symbol.upper()
+        with self._lock:
+            if not os.path.isdir(os.path.join(self.path, symbol)):
+                os.makedirs(os.path.join(self.path, symbol))
+
+            self._columns.pop(symbol, None)
+            names = [name for name in self.columns if name != 'date'] + ['date']
+            for name in names:
+                column_file = self._column_file(symbol, name)
+                with open(column_file + '.tmp', 'wb') as file:
+                    file.write(np.ascontiguousarray(columns[name], dtype=self.columns[name]).tobytes())
+                os.replace(column_file + '.tmp', column_file)
+
+    def _write(self, symbol, columns, length):
+        symbol = symbol.upper()
+        if not os.path.isdir(os.path.join(self.path, symbol)):
+            os.makedirs(os.path.join(self.path, symbol))
+
+        self._columns.pop(symbol, None)
+        names = [name for name in self.columns if name != 'date'] + ['date']
+        for name in names:
+            dtype = self.columns[name]
+            with open(self._column_file(symbol, name), 'ab') as file:
+                file.truncate(length * dtype.itemsize)
+                file.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+    def _length(self, symbol):
+        date_file = self._column_file(symbol, 'date')
+        if not os.path.isfile(date_file):
+            return 0
+        length = os.path.getsize(date_file) // self.columns['date'].itemsize
+        for name, dtype in self.columns.items():
+            if not os.path.isfile(self._column_file(symbol, name)) or os.path.getsize(self._column_file(symbol, name)) < length * dtype.itemsize:
+                return 0
+        return length
+
+    def _column_file(self, symbol, name):
+        return os.path.join(self.path, symbol.upper(), '%s.bin' % name)
+
+
+def _date_key(date):
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    return int(date.strftime("%Y%m%d"))
+
+
+def migrate_tinydb(db_file, store, symbol=None):
+    """Copies every day of a TinyDB file (data/iex_db_<SYMBOL>.json) into the store, returns the days added."""
+    from tinydb import TinyDB
+    from friartuck.iextrading.iextrading import quotes_to_columns
+
+    if not symbol:
+        symbol = os.path.basename(db_file)[len('iex_db_'):-len('.json')]
+
+    days = OrderedDict()
+    db = TinyDB(db_file)
+    for quote_data in db.all():
+        if 'date' in quote_data:
+            days.setdefault(quote_data['date'], []).append(quote_data)
+    db.close()
+
+    added = 0
+    for date_str in sorted(days):
+        if store.append_day(symbol, int(date_str), quotes_to_columns(days[date_str])):
+            added = added + 1
+
+    return added
+
+
+def main(data_dir, store_dir):
+    from friartuck.iextrading.iextrading import STORE_COLUMNS
+
+    store = IntradayBarStore(STORE_COLUMNS, store_dir)
+    for db_file in sorted(glob.glob(os.path.join(data_dir, 'iex_db_*.json'))):
+        added = migrate_tinydb(db_file, store)
+        print("%s: migrated %s days" % (db_file, added))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data",
+                        help="directory holding the iex_db_<SYMBOL>.json TinyDB files")
+    parser.add_argument("--store_dir", type=str, default="data/iex_store",
+                        help="directory of the columnar bar store")
+    args = parser.parse_args()
+    main(args.data_dir, args.store_dir)
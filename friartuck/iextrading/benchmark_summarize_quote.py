@@ -0,0 +1,162 @@
+"""
+Compares the row-by-row summarize_quote_old with the vectorized summarize_quote on a stored IEX day.
+
+    python -m friartuck.iextrading.benchmark_summarize_quote --db_file data/iex_db_WTW.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import timeit
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from friartuck.iextrading import iextrading
+from friartuck.iextrading.iextrading import get_field_value, is_valid_value
+
+
+def load_days(db_file):
+    with open(db_file, 'r') as file:
+        table = json.load(file)['_default']
+
+    days = {}
+    for doc_id in sorted(table, key=int):
+        quote_data = table[doc_id]
+        days.setdefault(quote_data['date'], []).append(quote_data)
+
+    return days
+
+
+def summarize_quote_old(quotes, minute_series):
+    if minute_series not in [1, 5, 15, 30, 60]:
+        quote_date = datetime.now()
+        quote_date = quote_date.replace(second=0, microsecond=0)
+        return pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
+                            data={'price': float("nan"),
+                                  'open': float("nan"),
+                                  'high': float("nan"),
+                                  'low': float("nan"),
+                                  'close': float("nan"),
+                                  'volume': int(0),
+                                  'date': quote_date})
+
+    bars = None
+    active_quote = None
+    for quote_data in quotes:
+        if "date" not in quote_data or ("close" not in quote_data and "marketClose" not in quote_data):
+            # quote_data['date'] = datetime.now().strftime("%Y%m%d")
+            continue
+
+        quote_date = datetime.strptime("%sT%s" % (quote_data['date'], quote_data['minute']), "%Y%m%dT%H:%M") - timedelta(hours=1)
+        # print(quote_date)
+        if quote_date.time() > quote_date.time().replace(hour=15, minute=0, second=0, microsecond=0):
+            continue
+
+        if not active_quote or ((minute_series in [1, 5, 15, 30] and quote_date.minute % minute_series == 0) or (minute_series in [60] and quote_date.hour != active_quote['date'].hour)):
+            if active_quote and active_quote['close'] != -1:
+                bar = pd.DataFrame(index=pd.DatetimeIndex([active_quote['date']]),
+                                   data=active_quote)
+
+                # print(close)
+                if bars is None:
+                    bars = bar
+                else:
+                    bars = bars.append(bar)
+            else:
+                print("not: %s" % active_quote)
+
+            # print(quote_data)
+            # active_quote = None
+
+            market_open = -1
+            market_close = -1
+            if "marketClose" in quote_data and quote_data['marketClose']:
+                market_close = is_valid_value(float(quote_data['marketClose']), float(get_field_value('close', quote_data, -1)))
+            if "marketOpen" in quote_data and quote_data['marketOpen']:
+                market_open = is_valid_value(float(quote_data['marketOpen']), float(get_field_value('open', quote_data, -1)))
+
+            active_quote = {'price': market_close,
+                            'open': market_open,
+                            'high': is_valid_value(float(get_field_value('marketHigh', quote_data, -1)), float(quote_data['high'])),
+                            'low': is_valid_value(float(get_field_value('marketLow', quote_data, -1)), float(quote_data['low'])),
+                            'close': market_close,
+                            'volume': is_valid_value(int(get_field_value('marketVolume', quote_data, -1)), int(quote_data['volume'])),
+                            'date': quote_date}
+
+            # print("1: %s" % active_quote)
+            # print("2: %s" % quote_data)
+        else:
+            if "marketClose" in quote_data:
+                if active_quote['open'] == -1:
+                    active_quote['open'] = is_valid_value(float(get_field_value('marketOpen', quote_data, -1)), float(get_field_value('open', quote_data, -1)))
+
+                new_close = is_valid_value(float(get_field_value('marketClose', quote_data, -1)), float(get_field_value('close', quote_data, -1)))
+                if new_close != -1:
+                    active_quote['price'] = new_close
+                    active_quote['close'] = new_close
+
+                new_volume = is_valid_value(int(quote_data['marketVolume']), int(quote_data['volume']))
+                if new_volume != -1:
+                    active_quote['volume'] = active_quote['volume']+new_volume
+
+                new_high = is_valid_value(float(get_field_value('marketHigh', quote_data, -1)), float(quote_data['high']))
+                new_low = is_valid_value(float(get_field_value('marketLow', quote_data, -1)), float(quote_data['low']))
+
+                if new_high != -1 and (active_quote['high'] == -1 or new_high > active_quote['high']):
+                    active_quote['high'] = new_high
+                if new_low != -1 and (active_quote['low'] == -1 or new_low < active_quote['low']):
+                    active_quote['low'] = new_low
+
+                # print("1x: %s" % active_quote)
+                # print("2x: %s" % quote_data)
+
+    if active_quote and active_quote['close'] != -1:
+        bar = pd.DataFrame(index=pd.DatetimeIndex([active_quote['date']]),
+                           data=active_quote)
+        # print(close)
+        if bars is None:
+            bars = bar
+        else:
+            bars = bars.append(bar)
+
+    if bars is None:
+        quote_date = datetime.now()
+        quote_date = quote_date.replace(second=0, microsecond=0)
+        bars = pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
+                            data={'price': float("nan"),
+                                  'open': float("nan"),
+                                  'high': float("nan"),
+                                  'low': float("nan"),
+                                  'close': float("nan"),
+                                  'volume': int(0),
+                                  'date': quote_date})
+
+    return bars
+
+
+def time_call(function, repeat):
+    # summarize_quote_old prints every skipped bar, keep that out of the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main(db_file, repeat):
+    days = load_days(db_file)
+    print("%-10s %6s %8s %12s %12s %8s" % ("date", "series", "records", "loop(ms)", "vector(ms)", "speedup"))
+    for date_str in sorted(days):
+        quotes = days[date_str]
+        for minute_series in [1, 5, 15, 30, 60]:
+            loop_time = time_call(lambda: summarize_quote_old(quotes, minute_series), repeat)
+            vector_time = time_call(lambda: iextrading.summarize_quote(quotes, minute_series), repeat)
+            print("%-10s %6s %8s %12.2f %12.2f %7.1fx" % (date_str, minute_series, len(quotes), loop_time * 1000, vector_time * 1000, loop_time / vector_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_file", type=str, default="data/iex_db_WTW.json",
+                        help="TinyDB file with raw IEX minute records")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of timed runs, the best one is reported")
+    args = parser.parse_args()
+    main(args.db_file, args.repeat)
@@ -1,21 +1,54 @@
 import json
 from datetime import timedelta, datetime
 import calendar
+import numpy as np
 import pandas as pd
-import urllib.request
-from tinydb import TinyDB, Query
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from friartuck import http_client
+from friartuck.iextrading.bar_store import DailyBarStore, IntradayBarStore
+from friartuck.lru_cache import LRUCache
+
+QUOTE_FIELDS = ['open', 'high', 'low', 'close', 'volume', 'marketOpen', 'marketHigh', 'marketLow', 'marketClose', 'marketVolume']
+# columns of the bars handed to FriarTuckQuoteSource, in order
+BAR_FIELDS = ['price', 'open', 'high', 'low', 'close', 'volume', 'date']
+HAS_CLOSE = 1
+HAS_MARKET_CLOSE = 2
+# most symbols IEX accepts in one /stock/market/batch request
+MAX_BATCH_SYMBOLS = 100
+STORE_COLUMNS = OrderedDict([('date', np.dtype('<i4')), ('minute', np.dtype('<i2')), ('flags', np.dtype('u1'))] +
+                            [(field, np.dtype('<f8')) for field in QUOTE_FIELDS])
+DAILY_COLUMNS = OrderedDict([('date', np.dtype('<i4')), ('open', np.dtype('<f8')), ('high', np.dtype('<f8')), ('low', np.dtype('<f8')),
+                             ('close', np.dtype('<f8')), ('volume', np.dtype('<i8'))])
+_MISSING = object()
+
+
+def from_config(config):
+    return IEXTrading(cache_bytes=config.getint('IEX', 'cache_bytes', fallback=64 * 1024 * 1024),
+                      max_workers=config.getint('QUOTE_SOURCE', 'max_workers', fallback=8),
+                      empty_day_ttl=config.getint('IEX', 'empty_day_ttl', fallback=24 * 60 * 60))
 
 
 class IEXTrading(object):
-    def __init__(self):
-        pass
+    def __init__(self, store_path='data/iex_store', daily_store_path='data/iex_daily', max_workers=8, cache_bytes=64 * 1024 * 1024, empty_day_ttl=24 * 60 * 60):
+        self.bar_store = IntradayBarStore(STORE_COLUMNS, store_path)
+        # (symbol, date, minute_series) -> summarized bars of a final trading day with quotes
+        self.bar_cache = LRUCache(cache_bytes)
+        # a final day IEX answered without quotes for is not asked for again within empty_day_ttl seconds: a holiday
+        # stays empty, a day lost to an outage or a rate limit is downloaded again after it
+        self.empty_day_ttl = empty_day_ttl
+        self.daily_store = DailyBarStore(DAILY_COLUMNS, daily_store_path)
+        # symbol -> (session date, bar count) of the last download, so a symbol whose history is shorter than
+        # requested or a market holiday do not trigger a download on every call
+        self._daily_refreshed = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
 
     def get_earnings_today(self):
         url = "https://api.iextrading.com/1.0/stock/market/today-earnings"
 
         print(url)
-        with urllib.request.urlopen(url) as response:
-            content = response.read()
+        content = http_client.get_content(url)
 
         # resp, content = self.client.request(url, "GET")
         # print(content)
@@ -23,33 +56,67 @@ class IEXTrading(object):
 
         return data
 
-    def get_quote_daily(self, symbol, bars=22, before_date=None):
+    def get_quote_daily(self, symbol, bars=22, before_date=None, fields=None):
+        return self.get_quote_daily_batch([symbol], bars, before_date, fields)[symbol]
+
+    def get_quote_daily_batch(self, symbols, bars=22, before_date=None, fields=None):
         if before_date:
             delta = (datetime.now().date() - before_date)
             day_diff = delta.days
             if day_diff > 0:
                 bars = bars+day_diff
 
-        if bars <= 20:
-            query_length = '1m'
-        elif bars <= 60:
-            query_length = '3m'
-        elif bars <= 120:
-            query_length = '6m'
-        elif bars <= 240:
-            query_length = '1y'
-        elif bars <= 480:
-            query_length = '2y'
-        else:
-            query_length = '5y'
+        # bars are served from the daily store, only the days it is missing are downloaded: the tail since the
+        # last stored day when it is deep enough, the whole range otherwise
+        session_date = _last_session_date()
+        refresh = {}
+        for symbol in symbols:
+            last_date = self.daily_store.last_date(symbol)
+            refreshed_date, depth = self._daily_refreshed.get(symbol.upper(), (None, 0))
+            depth = max(depth, len(self.daily_store.read(symbol)['date']))
+            if last_date and depth >= bars:
+                if last_date >= session_date or refreshed_date == session_date:
+                    continue
+
+                missing_days = int(np.busday_count(_int_to_date(last_date) + timedelta(days=1), _int_to_date(session_date) + timedelta(days=1)))
+                refresh.setdefault((_chart_range(missing_days), False), []).append(symbol)
+            else:
+                refresh.setdefault((_chart_range(bars), True), []).append(symbol)
+
+        requests = []
+        for (query_length, full), refresh_symbols in refresh.items():
+            requests.extend((query_length, full, refresh_symbols[i:i + MAX_BATCH_SYMBOLS]) for i in range(0, len(refresh_symbols), MAX_BATCH_SYMBOLS))
+
+        # today's bar is not final until the session is over, it is neither stored nor returned: the bars are the same
+        # whether this call downloaded them or the store had them
+        for (query_length, full, chunk), payload in zip(requests, self.executor.map(lambda request: self._get_daily_chart(request[2], request[0]), requests)):
+            for symbol in chunk:
+                columns = daily_columns(payload.get(symbol.upper(), {}).get('chart', []))
+                complete = columns['date'] <= session_date
+                stored_columns = {name: values[complete] for name, values in columns.items()}
+                if full:
+                    self.daily_store.replace(symbol, stored_columns)
+                    depth = bars
+                else:
+                    self.daily_store.append(symbol, stored_columns)
+                    depth = self._daily_refreshed.get(symbol.upper(), (None, 0))[1]
+                self._daily_refreshed[symbol.upper()] = (session_date, depth)
+
+        symbol_bars = {}
+        for symbol in symbols:
+            symbol_bars[symbol] = daily_bars(self.daily_store.read(symbol), bars, before_date, fields)
+
+        return symbol_bars
+
+    def _get_daily_chart(self, symbols, query_length):
+        if len(symbols) > 1:
+            return self._get_batch_chart(symbols, "range=%s" % query_length)
 
         # url = "https://api.iextrading.com/1.0/stock/%s/chart/%s?chartLast=%s" % (symbol.lower(), query_length, bars)
-        url = "https://api.iextrading.com/1.0/stock/%s/chart/%s" % (symbol.lower(), query_length)
+        url = "https://api.iextrading.com/1.0/stock/%s/chart/%s" % (symbols[0].lower(), query_length)
 
         print(url)
-        bars_df = None
-        with urllib.request.urlopen(url) as response:
-            content = response.read()
+        content = http_client.get_content(url)
 
         # resp, content = self.client.request(url, "GET")
         # print(content)
@@ -59,41 +126,16 @@ class IEXTrading(object):
         # print(quotes)
         print(len(quotes))
 
-        for quote_data in quotes:
-            quote_date = datetime.strptime(quote_data['date'], "%Y-%m-%d")
+        return {symbols[0].upper(): {'chart': quotes}}
 
-            if before_date and quote_date.date() >= before_date:
-                break
+    def _get_batch_chart(self, symbols, params):
+        url = "https://api.iextrading.com/1.0/stock/market/batch?symbols=%s&types=chart&%s" % (",".join(symbols).lower(), params)
 
-            bar = pd.DataFrame(index=pd.DatetimeIndex([quote_date]),
-                               data={'price': quote_data['close'],
-                                     'open': quote_data['open'],
-                                     'high': float(quote_data['high']),
-                                     'low': float(quote_data['low']),
-                                     'close': quote_data['close'],
-                                     'volume': int(quote_data['volume']),
-                                     'date': quote_date})
+        print(url)
+        content = http_client.get_content(url)
 
-            # print(close)
-            if bars_df is None:
-                bars_df = bar
-            else:
-                bars_df = bars_df.append(bar)
-
-        if bars_df is None:
-            # log.warn("Unexpected, could not retrieve quote for security (%s) " % symbol)
-            # bars = pd.DataFrame(index=[6], columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'])
-            quote_date = datetime.now()
-            quote_date = quote_date.replace(second=0, microsecond=0)
-            bars = pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
-                                data={'price': float("nan"),
-                                      'open': float("nan"),
-                                      'high': float("nan"),
-                                      'low': float("nan"),
-                                      'close': float("nan"),
-                                      'volume': int(0),
-                                      'date': quote_date})
-        return bars_df.tail(bars)
+        # {"AAPL": {"chart": [...]}, "FB": {"chart": [...]}}
+        return json.loads(content.decode('utf-8'))
 
     def get_quote_daily_old(self, symbol, bars=22):
 
@@ -114,8 +156,7 @@ class IEXTrading(object):
 
         print(url)
         bars = None
-        with urllib.request.urlopen(url) as response:
-            content = response.read()
+        content = http_client.get_content(url)
 
         # resp, content = self.client.request(url, "GET")
         # print(content)
@@ -157,15 +198,16 @@ class IEXTrading(object):
                                       'date': quote_date})
         return bars
 
-    def get_quote_intraday(self, symbol, minute_series, last_quote_time):
+    def get_quote_intraday(self, symbol, minute_series, last_quote_time, fields=None):
+        # today's bars after last_quote_time, same window as AlphaVantage.get_quote_intraday
         if not last_quote_time:
-            last_quote_time = datetime.now().replace(hour=8, minute=30, second=0, microsecond=0)
+            last_quote_time = datetime.now().replace(hour=8, minute=25, second=0, microsecond=0)
 
         start_time = last_quote_time
 
         end_time = last_quote_time.replace(hour=15, minute=0, second=0, microsecond=0)
 
-        diff = (end_time - start_time).seconds / 60
+        diff = int((end_time - start_time).total_seconds() / 60)
 
         print("diff: %s" % diff)
 
@@ -173,8 +215,7 @@ class IEXTrading(object):
               "chartLast=%s" % (symbol.lower(), diff)
 
         print(url)
-        with urllib.request.urlopen(url) as response:
-            content = response.read()
+        content = http_client.get_content(url)
 
         # resp, content = self.client.request(url, "GET")
         # print(content)
@@ -184,44 +225,110 @@ class IEXTrading(object):
         # print(quotes)
         print(len(quotes))
 
-        return self.summarize_quote(quotes, minute_series)
+        bars = summarize_quote(quotes, minute_series, fields)
+        bars = bars[bars.index > last_quote_time]
+        if len(bars) == 0 or np.isnan(float(bars.iloc[0]['close'])):
+            return _nan_bars()
+
+        return bars
 
     def _get_quote_intraday_by_date(self, symbol, date):
-        db = TinyDB('data/iex_db_%s.json' % symbol)
-        quote_query = Query()
         datestr = date.strftime("%Y%m%d")
-        quotes = db.search(quote_query.date == datestr)
-        if quotes and len(quotes) > 0:
-            print("from db: %s" % len(quotes))
+        quotes = self.bar_store.read_day(symbol, date)
+        if quotes is not None:
+            print("from store: %s" % len(quotes['date']))
             return quotes
+        if self.bar_store.is_empty_day(symbol, date, self.empty_day_ttl):
+            return quotes_to_columns([])
 
         url = "https://api.iextrading.com/1.0/stock/%s/chart/date/%s" % (symbol.lower(), datestr)
 
         print(url)
-        with urllib.request.urlopen(url) as response:
-            content = response.read()
+        content = http_client.get_content(url)
 
         # resp, content = self.client.request(url, "GET")
         # print(content)
         data = json.loads(content.decode('utf-8'))
-        quotes = data
 
         # print(quotes)
-        print(len(quotes))
-        if len(quotes) > 0:
-            current_datetime = datetime.now()
-            if date < current_datetime.date() or current_datetime > current_datetime.replace(hour=16, minute=0, second=0, microsecond=0):
-                print("storing quotes:")
-                db.insert_multiple(quotes)
+        print(len(data))
+        return self._store_quotes(symbol, date, data)
+
+    def _store_quotes(self, symbol, date, data):
+        quotes = quotes_to_columns(data)
+        if len(data) > 0 and _is_final_day(date):
+            print("storing quotes:")
+            self.bar_store.append_day(symbol, date, quotes)
+        elif _is_final_day(date):
+            self.bar_store.mark_empty_day(symbol, date)
 
         return quotes
 
-    def get_quote_intraday_hist_by_date(self, symbol, minute_series, date):
-        quote_bars = None
+    def _get_quotes_intraday_by_dates(self, pairs):
+        # quotes of each (symbol, date) of pairs: days already in the store are read in place, the others are downloaded
+        # concurrently, one request per day for a single symbol, batch requests of up to MAX_BATCH_SYMBOLS symbols per
+        # day otherwise
+        dates = sorted(set(date for symbol, date in pairs))
+        requests = []
+        for date in dates:
+            missing = [symbol for symbol, pair_date in pairs if pair_date == date and not self.bar_store.has_day(symbol, date) and
+                       not self.bar_store.is_empty_day(symbol, date, self.empty_day_ttl)]
+            if len(missing) == 1:
+                requests.append((date, missing))
+            else:
+                requests.extend((date, missing[i:i + MAX_BATCH_SYMBOLS]) for i in range(0, len(missing), MAX_BATCH_SYMBOLS))
+
+        quotes = {}
+        for (date, chunk), chunk_quotes in zip(requests, self.executor.map(lambda request: self._get_quotes_intraday_chunk(*request), requests)):
+            for symbol in chunk:
+                quotes[(symbol, date)] = chunk_quotes[symbol]
+
+        for symbol, date in pairs:
+            if (symbol, date) not in quotes:
+                quotes[(symbol, date)] = self._get_quote_intraday_by_date(symbol, date)
+
+        return quotes
+
+    def _get_quotes_intraday_chunk(self, date, symbols):
+        if len(symbols) == 1:
+            return {symbols[0]: self._get_quote_intraday_by_date(symbols[0], date)}
+
+        payload = self._get_batch_chart(symbols, "range=date&exactDate=%s" % date.strftime("%Y%m%d"))
+        return {symbol: self._store_quotes(symbol, date, payload.get(symbol.upper(), {}).get('chart', [])) for symbol in symbols}
+
+    def _get_bars_intraday_by_dates(self, symbols, minute_series, dates, fields=None):
+        # summarized bars per (symbol, date), served from bar_cache when the day is final and was seen before;
+        # days are cached with the fields they were built with, a day with every field serves any projection
+        fields_key = _fields_key(fields)
+        day_bars = {}
+        for date in dates:
+            for symbol in symbols:
+                cached = self.bar_cache.get((symbol.upper(), date, minute_series, fields_key), _MISSING)
+                if cached is _MISSING and fields_key is not None:
+                    cached = self.bar_cache.get((symbol.upper(), date, minute_series, None), _MISSING)
+                    if cached is not _MISSING and cached is not None:
+                        cached = cached[list(fields_key)]
+                if cached is not _MISSING:
+                    day_bars[(symbol, date)] = cached
+
+        # only the (symbol, date) pairs not cached, not every missing symbol on every missing date
+        missing = [(symbol, date) for date in dates for symbol in symbols if (symbol, date) not in day_bars]
+        if missing:
+            quotes = self._get_quotes_intraday_by_dates(missing)
+            for (symbol, date), day_quotes in quotes.items():
+                my_bars = None
+                if len(day_quotes['date']) > 0:
+                    my_bars = summarize_columns(day_quotes, minute_series, fields)
+                if my_bars is not None and _is_final_day(date):
+                    self.bar_cache.put((symbol.upper(), date, minute_series, fields_key), my_bars)
+                day_bars[(symbol, date)] = my_bars
+
+        return day_bars
 
-        quotes = self._get_quote_intraday_by_date(symbol, date)
-        if len(quotes) > 0:
-            quote_bars = summarize_quote(quotes, minute_series)
+    def get_quote_intraday_hist_by_date(self, symbol, minute_series, date):
+        quote_bars = self._get_bars_intraday_by_dates([symbol], minute_series, [date])[(symbol, date)]
+        if quote_bars is not None:
+            quote_bars = quote_bars.copy()
 
         if quote_bars is None:
             quote_date = datetime.now()
@@ -237,154 +344,272 @@ class IEXTrading(object):
 
         return quote_bars
 
-    def get_quote_intraday_hist_by_bars(self, symbol, minute_series, bars=1, before_date=None):
+    def get_quote_intraday_hist_by_bars(self, symbol, minute_series, bars=1, before_date=None, fields=None):
+        return self.get_quote_intraday_hist_by_bars_batch([symbol], minute_series, bars, before_date, fields)[symbol]
+
+    def get_quote_intraday_hist_by_bars_batch(self, symbols, minute_series, bars=1, before_date=None, fields=None):
         if before_date:
-            date = before_date
+            date = before_date - timedelta(days=1)
         else:
             date = datetime.now()
         # if date.hour < 15:
         #    # if intra-day, start with previous
         #    date = date - timedelta(days=1)
 
-        date_ctr = 0
-        quote_bars = None
-        while date_ctr < 35 and (quote_bars is None or len(quote_bars) < bars):
-            while date.weekday() in [5, 6] or (before_date and date >= before_date):
-                date = date - timedelta(days=1)
-
-            quotes = self._get_quote_intraday_by_date(symbol, date.date())
-            date_ctr = date_ctr+1
+        trading_days = []
+        while len(trading_days) < 35:
+            if date.weekday() not in [5, 6]:
+                trading_days.append(date.date())
             date = date - timedelta(days=1)
 
-            if len(quotes) == 0:
-                continue
-
-            my_bars = summarize_quote(quotes, minute_series)
-            if quote_bars is None:
-                quote_bars = my_bars
+        # a full session has 390 minutes; fetch as many days as should cover the bars (plus one for today/holidays)
+        # in one go and only go further back for the symbols that came up short
+        bars_per_day = -(-390 // minute_series) if minute_series in [1, 5, 15, 30] else 7
+        day_bars = {symbol: [] for symbol in symbols}
+        bar_totals = {symbol: 0 for symbol in symbols}
+        pending = list(symbols)
+        day_ctr = 0
+        while day_ctr < len(trading_days) and pending:
+            day_count = -(-(bars - min(bar_totals[symbol] for symbol in pending)) // bars_per_day) + 1
+            dates = trading_days[day_ctr:day_ctr + day_count]
+            day_ctr = day_ctr + len(dates)
+
+            bars_by_date = self._get_bars_intraday_by_dates(pending, minute_series, dates, fields)
+            for symbol in pending:
+                for date in dates:
+                    my_bars = bars_by_date[(symbol, date)]
+                    if my_bars is None:
+                        continue
+
+                    day_bars[symbol].append(my_bars)
+                    bar_totals[symbol] = bar_totals[symbol] + len(my_bars)
+
+            pending = [symbol for symbol in pending if bar_totals[symbol] < bars]
+
+        symbol_bars = {}
+        for symbol in symbols:
+            if day_bars[symbol]:
+                symbol_bars[symbol] = pd.concat(day_bars[symbol][::-1]).tail(bars)
             else:
-                quote_bars = pd.concat([my_bars, quote_bars])
+                symbol_bars[symbol] = _nan_bars()
 
-        if quote_bars is None:
-            quote_date = datetime.now()
-            quote_date = quote_date.replace(second=0, microsecond=0)
-            quote_bars = pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
-                                      data={'price': float("nan"),
-                                            'open': float("nan"),
-                                            'high': float("nan"),
-                                            'low': float("nan"),
-                                            'close': float("nan"),
-                                            'volume': int(0),
-                                            'date': quote_date})
+        return symbol_bars
 
-        return quote_bars.tail(bars)
-
-
-def summarize_quote(quotes, minute_series):
-    if minute_series not in [1, 5, 15, 30, 60]:
-        quote_date = datetime.now()
-        quote_date = quote_date.replace(second=0, microsecond=0)
-        return pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
-                            data={'price': float("nan"),
-                                  'open': float("nan"),
-                                  'high': float("nan"),
-                                  'low': float("nan"),
-                                  'close': float("nan"),
-                                  'volume': int(0),
-                                  'date': quote_date})
-
-    bars = None
-    active_quote = None
-    for quote_data in quotes:
-        if "date" not in quote_data or ("close" not in quote_data and "marketClose" not in quote_data):
-            # quote_data['date'] = datetime.now().strftime("%Y%m%d")
-            continue
-
-        quote_date = datetime.strptime("%sT%s" % (quote_data['date'], quote_data['minute']), "%Y%m%dT%H:%M") - timedelta(hours=1)
-        # print(quote_date)
-        if quote_date.time() > quote_date.time().replace(hour=15, minute=0, second=0, microsecond=0):
-            continue
-
-        if not active_quote or ((minute_series in [1, 5, 15, 30] and quote_date.minute % minute_series == 0) or (minute_series in [60] and quote_date.hour != active_quote['date'].hour)):
-            if active_quote and active_quote['close'] != -1:
-                bar = pd.DataFrame(index=pd.DatetimeIndex([active_quote['date']]),
-                                   data=active_quote)
-
-                # print(close)
-                if bars is None:
-                    bars = bar
-                else:
-                    bars = bars.append(bar)
-            else:
-                print("not: %s" % active_quote)
-
-            # print(quote_data)
-            # active_quote = None
-
-            market_open = -1
-            market_close = -1
-            if "marketClose" in quote_data and quote_data['marketClose']:
-                market_close = is_valid_value(float(quote_data['marketClose']), float(get_field_value('close', quote_data, -1)))
-            if "marketOpen" in quote_data and quote_data['marketOpen']:
-                market_open = is_valid_value(float(quote_data['marketOpen']), float(get_field_value('open', quote_data, -1)))
-
-            active_quote = {'price': market_close,
-                            'open': market_open,
-                            'high': is_valid_value(float(get_field_value('marketHigh', quote_data, -1)), float(quote_data['high'])),
-                            'low': is_valid_value(float(get_field_value('marketLow', quote_data, -1)), float(quote_data['low'])),
-                            'close': market_close,
-                            'volume': is_valid_value(int(get_field_value('marketVolume', quote_data, -1)), int(quote_data['volume'])),
-                            'date': quote_date}
-
-            # print("1: %s" % active_quote)
-            # print("2: %s" % quote_data)
-        else:
-            if "marketClose" in quote_data:
-                if active_quote['open'] == -1:
-                    active_quote['open'] = is_valid_value(float(get_field_value('marketOpen', quote_data, -1)), float(get_field_value('open', quote_data, -1)))
-
-                new_close = is_valid_value(float(get_field_value('marketClose', quote_data, -1)), float(get_field_value('close', quote_data, -1)))
-                if new_close != -1:
-                    active_quote['price'] = new_close
-                    active_quote['close'] = new_close
-
-                new_volume = is_valid_value(int(quote_data['marketVolume']), int(quote_data['volume']))
-                if new_volume != -1:
-                    active_quote['volume'] = active_quote['volume']+new_volume
-
-                new_high = is_valid_value(float(get_field_value('marketHigh', quote_data, -1)), float(quote_data['high']))
-                new_low = is_valid_value(float(get_field_value('marketLow', quote_data, -1)), float(quote_data['low']))
-
-                if new_high != -1 and (active_quote['high'] == -1 or new_high > active_quote['high']):
-                    active_quote['high'] = new_high
-                if new_low != -1 and (active_quote['low'] == -1 or new_low < active_quote['low']):
-                    active_quote['low'] = new_low
-
-                # print("1x: %s" % active_quote)
-                # print("2x: %s" % quote_data)
-
-    if active_quote and active_quote['close'] != -1:
-        bar = pd.DataFrame(index=pd.DatetimeIndex([active_quote['date']]),
-                           data=active_quote)
-        # print(close)
-        if bars is None:
-            bars = bar
-        else:
-            bars = bars.append(bar)
-
-    if bars is None:
-        quote_date = datetime.now()
-        quote_date = quote_date.replace(second=0, microsecond=0)
-        bars = pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
-                            data={'price': float("nan"),
-                                  'open': float("nan"),
-                                  'high': float("nan"),
-                                  'low': float("nan"),
-                                  'close': float("nan"),
-                                  'volume': int(0),
-                                  'date': quote_date})
-
-    return bars
+
+def _chart_range(bars):
+    if bars <= 20:
+        return '1m'
+    elif bars <= 60:
+        return '3m'
+    elif bars <= 120:
+        return '6m'
+    elif bars <= 240:
+        return '1y'
+    elif bars <= 480:
+        return '2y'
+
+    return '5y'
+
+
+def _is_final_day(date):
+    current_datetime = datetime.now()
+    return date < current_datetime.date() or current_datetime > current_datetime.replace(hour=16, minute=0, second=0, microsecond=0)
+
+
+def _last_session_date():
+    # the last trading day whose daily bar is final
+    session_date = datetime.now()
+    if session_date < session_date.replace(hour=16, minute=0, second=0, microsecond=0):
+        session_date = session_date - timedelta(days=1)
+    while session_date.weekday() in [5, 6]:
+        session_date = session_date - timedelta(days=1)
+
+    return int(session_date.strftime("%Y%m%d"))
+
+
+def _int_to_date(date_key):
+    return datetime.strptime(str(date_key), "%Y%m%d").date()
+
+
+def daily_columns(quotes):
+    return {'date': np.array([int(quote_data['date'].replace('-', '')) for quote_data in quotes], dtype=np.int32),
+            'open': np.array([quote_data['open'] for quote_data in quotes], dtype=np.float64),
+            'high': np.array([quote_data['high'] for quote_data in quotes], dtype=np.float64),
+            'low': np.array([quote_data['low'] for quote_data in quotes], dtype=np.float64),
+            'close': np.array([quote_data['close'] for quote_data in quotes], dtype=np.float64),
+            'volume': np.array([quote_data['volume'] for quote_data in quotes], dtype=np.int64)}
+
+
+def daily_bars(columns, bars, before_date=None, fields=None):
+    if before_date:
+        earlier = columns['date'] < int(before_date.strftime("%Y%m%d"))
+        columns = {name: values[earlier] for name, values in columns.items()}
+
+    columns = {name: values[-bars:] for name, values in columns.items()}
+    if len(columns['date']) == 0:
+        # log.warn("Unexpected, could not retrieve quote for security (%s) " % symbol)
+        return _nan_bars()
+
+    # only the requested columns are copied out of the store
+    fields = bar_fields(fields)
+    quote_dates = pd.to_datetime(columns['date'].astype(str), format="%Y%m%d")
+    return pd.DataFrame(index=pd.DatetimeIndex(quote_dates), columns=fields,
+                        data={field: quote_dates if field == 'date' else np.array(columns['close' if field == 'price' else field]) for field in fields})
+
+
+def summarize_quote(quotes, minute_series, fields=None):
+    return summarize_columns(quotes_to_columns(quotes), minute_series, fields)
+
+
+def quotes_to_columns(quotes):
+    """Converts raw IEX minute records (list of dicts) into one numpy array per field.
+
+    Missing/null values become NaN, 'date' becomes an int (yyyymmdd), 'minute' the minutes since midnight
+    and 'flags' records whether the 'close'/'marketClose' keys were present in the record.
+    """
+    columns = {'date': np.array([_date_to_int(quote_data.get('date')) for quote_data in quotes], dtype=np.int32),
+               'minute': np.array([_minute_to_int(quote_data.get('minute')) for quote_data in quotes], dtype=np.int16),
+               'flags': np.array([(HAS_CLOSE if 'close' in quote_data else 0) | (HAS_MARKET_CLOSE if 'marketClose' in quote_data else 0) for quote_data in quotes], dtype=np.uint8)}
+    for field in QUOTE_FIELDS:
+        values = pd.Series([quote_data.get(field) for quote_data in quotes], dtype=object)
+        columns[field] = pd.to_numeric(values, errors='coerce').values.astype(np.float64)
+
+    return columns
+
+
+def summarize_columns(columns, minute_series, fields=None):
+    """Aggregates a day of columnar IEX minute records into bars of minute_series (1, 5, 15, 30, 60) minutes.
+
+    Vectorized equivalent of the row-by-row summarize_quote_old (kept in benchmark_summarize_quote): a bar starts on the first record, on every minute divisible
+    by minute_series (or on an hour change for 60), takes the market* value when valid and falls back to the
+    IEX-only value, and bars without a valid close are dropped. Only the BAR_FIELDS in fields (all by default)
+    are computed.
+    """
+    fields = bar_fields(fields)
+    if minute_series not in [1, 5, 15, 30, 60] or len(columns['date']) == 0:
+        return _nan_bars()
+
+    flags = columns['flags']
+    valid = (columns['date'] > 0) & (columns['minute'] >= 0) & ((flags & (HAS_CLOSE | HAS_MARKET_CLOSE)) != 0)
+    unique_dates, date_positions = np.unique(np.where(valid, columns['date'], 19700101), return_inverse=True)
+    days = pd.to_datetime(unique_dates.astype(str), format="%Y%m%d").values[date_positions]
+    # IEX minutes are in eastern time, bars are in local (central) time
+    quote_dates = days + ((columns['minute'].astype(np.int64) - 60) * 60 * 10**9).astype('timedelta64[ns]')
+    day_minutes = (columns['minute'].astype(np.int64) - 60) % 1440
+    valid &= day_minutes <= 15 * 60
+    if not valid.any():
+        return _nan_bars()
+
+    day_minutes = day_minutes[valid]
+    if minute_series == 60:
+        hours = day_minutes // 60
+        starts = np.concatenate(([True], hours[1:] != hours[:-1]))
+    else:
+        starts = day_minutes % minute_series == 0
+        starts[0] = True
+
+    # a record that does not start a bar only contributes when it carries a marketClose
+    keep = starts | ((flags[valid] & HAS_MARKET_CLOSE) != 0)
+    starts = starts[keep]
+    quote_dates = quote_dates[valid][keep]
+    needed = set(['close', 'marketClose'])
+    if 'open' in fields:
+        needed.update(['open', 'marketOpen'])
+    if 'high' in fields:
+        needed.update(['high', 'marketHigh'])
+    if 'low' in fields:
+        needed.update(['low', 'marketLow'])
+    if 'volume' in fields:
+        needed.update(['volume', 'marketVolume'])
+    raw = {field: columns[field][valid][keep] for field in needed}
+    value = {field: _field_value(raw[field]) for field in needed}
+
+    start_idx = np.flatnonzero(starts)
+    positions = np.arange(len(starts))
+
+    # first record of a bar: a missing/falsy marketClose/marketOpen leaves the value unset (-1)
+    start_close = np.where(value['marketClose'] != -1, value['marketClose'], np.where(raw['marketClose'] == -1, value['close'], -1))
+    closes = np.where(starts, start_close, np.where(value['marketClose'] != -1, value['marketClose'], value['close']))
+    last_close = np.maximum.reduceat(np.where(closes != -1, positions, -1), start_idx)
+    bar_close = np.where(last_close >= 0, closes[np.maximum(last_close, 0)], -1)
+    closed = bar_close != -1
+    if not closed.any():
+        return _nan_bars()
+
+    bar_dates = quote_dates[start_idx][closed]
+    data = {'price': bar_close[closed], 'close': bar_close[closed], 'date': bar_dates}
+    if 'open' in fields:
+        start_open = np.where(value['marketOpen'] != -1, value['marketOpen'], np.where(raw['marketOpen'] == -1, value['open'], -1))
+        opens = np.where(starts, start_open, np.where(value['marketOpen'] != -1, value['marketOpen'], value['open']))
+        first_open = np.minimum.reduceat(np.where(opens != -1, positions, len(starts)), start_idx)
+        data['open'] = np.where(first_open < len(starts), opens[np.minimum(first_open, len(starts) - 1)], -1)[closed]
+    if 'high' in fields:
+        highs = np.where(value['marketHigh'] != -1, value['marketHigh'], _missing_to(raw['high']))
+        bar_high = np.maximum.reduceat(np.where(highs != -1, highs, -np.inf), start_idx)
+        bar_high[np.isneginf(bar_high)] = -1
+        data['high'] = bar_high[closed]
+    if 'low' in fields:
+        lows = np.where(value['marketLow'] != -1, value['marketLow'], _missing_to(raw['low']))
+        bar_low = np.minimum.reduceat(np.where(lows != -1, lows, np.inf), start_idx)
+        bar_low[np.isposinf(bar_low)] = -1
+        data['low'] = bar_low[closed]
+    if 'volume' in fields:
+        market_volume = _missing_to(raw['marketVolume'])
+        volumes = np.where(starts,
+                           np.where(value['marketVolume'] != -1, value['marketVolume'], _missing_to(raw['volume'])),
+                           np.where(market_volume != -1, market_volume, _missing_to(raw['volume'])))
+        volumes = np.where(starts | (volumes != -1), volumes, 0)
+        data['volume'] = np.add.reduceat(volumes, start_idx).astype(np.int64)[closed]
+
+    return pd.DataFrame(index=pd.DatetimeIndex(bar_dates), columns=fields, data={field: data[field] for field in fields})
+
+
+def bar_fields(fields=None):
+    """The BAR_FIELDS to build for fields (a field name or a list of them, None for all), in BAR_FIELDS order."""
+    if fields is None:
+        return list(BAR_FIELDS)
+    if isinstance(fields, str):
+        fields = [fields]
+    return [field for field in BAR_FIELDS if field in fields]
+
+
+def _fields_key(fields):
+    return None if fields is None else tuple(bar_fields(fields))
+
+
+def _field_value(values):
+    # vectorized get_field_value(field, quote_data, -1): missing, null and 0 all map to -1
+    return np.where(np.isnan(values) | (values == 0), -1, values)
+
+
+def _missing_to(values, default=-1):
+    return np.where(np.isnan(values), default, values)
+
+
+def _date_to_int(date_str):
+    if not date_str:
+        return 0
+    return int(date_str)
+
+
+def _minute_to_int(minute_str):
+    if not minute_str:
+        return -1
+    hour, minute = minute_str.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def _nan_bars():
+    quote_date = datetime.now()
+    quote_date = quote_date.replace(second=0, microsecond=0)
+    return pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
+                        data={'price': float("nan"),
+                              'open': float("nan"),
+                              'high': float("nan"),
+                              'low': float("nan"),
+                              'close': float("nan"),
+                              'volume': int(0),
+                              'date': quote_date})
 
 
 def is_valid_value(value, default):
@@ -0,0 +1,74 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class LatencyStats(object):
+    """Rolling window of the latest request latencies and failures, per key (provider, endpoint...)."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._latencies = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds, ok=True):
+        with self._lock:
+            if key not in self._latencies:
+                self._latencies[key] = deque(maxlen=self.window)
+                self._failures[key] = deque(maxlen=self.window)
+            self._latencies[key].append(seconds)
+            self._failures[key].append(0 if ok else 1)
+
+    def count(self, key):
+        with self._lock:
+            return len(self._latencies.get(key, ()))
+
+    def percentile(self, key, q, default=None):
+        with self._lock:
+            latencies = list(self._latencies.get(key, ()))
+        if not latencies:
+            return default
+        return float(np.percentile(latencies, q))
+
+    def error_rate(self, key, default=0.0):
+        with self._lock:
+            failures = list(self._failures.get(key, ()))
+        if not failures:
+            return default
+        return sum(failures) / float(len(failures))
+
+    def stats(self):
+        with self._lock:
+            keys = list(self._latencies)
+        return {key: {'count': self.count(key), 'p50': self.percentile(key, 50), 'p95': self.percentile(key, 95),
+                      'error_rate': self.error_rate(key)} for key in keys}
+
+    def __str__(self):
+        return str(self.stats())
+
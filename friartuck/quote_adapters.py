@@ -0,0 +1,114 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import importlib
+import logging
+import threading
+
+log = logging.getLogger("friar_tuck")
+
+# name -> "module:factory", the factory takes the config and returns the adapter
+BUILTIN_ADAPTERS = {'iex': 'friartuck.iextrading.iextrading:from_config',
+                    'alphavantage': 'friartuck.alphavantage.alphavantage:from_config',
+                    'robinhood': 'friartuck.robinhood_quote_source:from_config'}
+# setuptools entry points of this group add adapters from other packages, e.g.
+#   entry_points={'friartuck.quote_adapters': ['mysource = mypackage.quotes:from_config']}
+ENTRY_POINT_GROUP = 'friartuck.quote_adapters'
+
+
+class AdapterRegistry(object):
+    """Quote source adapters by name, each imported and built on first use.
+
+    Names resolve, in order, to what was register()ed, the [QUOTE_SOURCE] adapters config
+    (comma separated name = module:factory), BUILTIN_ADAPTERS and the ENTRY_POINT_GROUP entry points.
+
+    FriarTuckQuoteSource asks an adapter for (by role):
+        intraday: get_quote_intraday(symbol=, interval=, since_last_quote_time=, fields=), bars after
+                  since_last_quote_time with a 'connected' column (AlphaVantage.get_quote_intraday)
+        history:  get_quote_intraday_hist_by_bars(symbol=, minute_series=, bars=, before_date=, fields=) and
+                  optionally get_quote_intraday_hist_by_bars_batch(symbols=, ...) returning {symbol: bars}
+        daily:    get_quote_daily(symbol=, bars=, fields=) and optionally get_quote_daily_batch(symbols=, ...)
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._targets = dict(BUILTIN_ADAPTERS)
+        for entry in config.get('QUOTE_SOURCE', 'adapters', fallback='').split(','):
+            if entry.strip():
+                name, _, target = entry.partition('=')
+                self._targets[name.strip()] = target.strip()
+        self._adapters = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, target):
+        # target: "module:factory" or the factory itself
+        with self._lock:
+            self._targets[name] = target
+            self._adapters.pop(name, None)
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._adapters:
+                factory = self._factory(name)
+                log.info("loading quote adapter (%s)" % name)
+                self._adapters[name] = factory(self.config)
+
+            return self._adapters[name]
+
+    def loaded(self):
+        return sorted(self._adapters)
+
+    def _factory(self, name):
+        target = self._targets.get(name)
+        if target is None:
+            target = _entry_points().get(name)
+        if target is None:
+            raise KeyError("no quote adapter named (%s), known adapters (%s)" % (name, sorted(self._targets)))
+        if callable(target):
+            return target
+
+        module_name, _, attribute = target.partition(':')
+        return getattr(importlib.import_module(module_name), attribute)
+
+
+def _entry_points():
+    # {name: factory} of the installed ENTRY_POINT_GROUP entry points, loaded only when looked up
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return {}
+        return {entry_point.name: _entry_point_factory(entry_point) for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)}
+
+    found = entry_points()
+    group = found.select(group=ENTRY_POINT_GROUP) if hasattr(found, 'select') else found.get(ENTRY_POINT_GROUP, [])
+    return {entry_point.name: _entry_point_factory(entry_point) for entry_point in group}
+
+
+def _entry_point_factory(entry_point):
+    def factory(config):
+        return entry_point.load()(config)
+    return factory
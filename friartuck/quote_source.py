@@ -22,20 +22,33 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import heapq
 import logging
+import threading
 import time
 
 import urllib.request
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from functools import partial
 import pandas as pd
 import numpy as np
-from friartuck.iextrading import iextrading
-from friartuck.alphavantage import alphavantage
+from friartuck import http_client
+from friartuck.freshness import FreshnessTracker
+from friartuck.latency_stats import LatencyStats
+from friartuck.source_router import SourceRouter, stats_key
+from friartuck.quote_adapters import AdapterRegistry
 
 
 log = logging.getLogger("friar_tuck")
 
+# columns of the bars the quote sources return, in order
+BAR_FIELDS = ['price', 'open', 'high', 'low', 'close', 'volume', 'date']
+FRESH = 'fresh'
+STALE = 'stale'
+MISSING = 'missing'
+
 
 class QuoteSourceAbstract:
     @abstractmethod
@@ -48,70 +61,219 @@ class QuoteSourceAbstract:
 
 class FriarTuckQuoteSource(QuoteSourceAbstract):
     allowed_history_frequency = {'1m': 1, '5m': 5, '15m': 15, '1h': 60, '1d': 1}
+    intraday_providers = ['alphavantage', 'iex']
+    history_provider = 'iex'
+    daily_providers = ['iex', 'alphavantage']
 
-    def __init__(self, config):
+    def __init__(self, config, adapters=None, freshness=None):
         self.config = config
-        self.alpha = alphavantage.AlphaVantage(config.get('ALPHA_VANTAGE', 'apikey'))
-        self.iex = iextrading.IEXTrading()
-
-    def fetch_intraday_quotes(self, symbol, since_last_quote_time=None, frequency='1m', field=None):
+        # adapters are named by role in [QUOTE_SOURCE] (intraday_providers, history_provider, daily_providers) and
+        # only imported and built once a request needs them, see quote_adapters.AdapterRegistry
+        self.adapters = adapters or AdapterRegistry(config)
+        self.intraday_providers = _provider_list(config.get('QUOTE_SOURCE', 'intraday_providers', fallback=None), self.intraday_providers)
+        self.history_provider = config.get('QUOTE_SOURCE', 'history_provider', fallback=self.history_provider)
+        self.daily_providers = _provider_list(config.get('QUOTE_SOURCE', 'daily_providers', fallback=None), self.daily_providers)
+
+        # [QUOTE_SOURCE] concurrent_fetch = yes fans multi-symbol requests out on a bounded pool,
+        # max_per_host caps the requests in flight to any one data provider, each is cut off after route_timeout seconds
+        self.executor = None
+        if config.getboolean('QUOTE_SOURCE', 'concurrent_fetch', fallback=False):
+            self.executor = ThreadPoolExecutor(max_workers=config.getint('QUOTE_SOURCE', 'max_workers', fallback=8))
+        http_client.configure(max_per_host=config.getint('QUOTE_SOURCE', 'max_per_host', fallback=0),
+                              timeout=config.getfloat('QUOTE_SOURCE', 'route_timeout', fallback=10))
+
+        # seconds before the first retry of a symbol AlphaVantage is not connected for (doubled on every retry),
+        # and the overall time a fetch keeps retrying
+        self.retry_backoff = config.getfloat('ALPHA_VANTAGE', 'retry_backoff', fallback=2)
+        self.retry_deadline = config.getfloat('ALPHA_VANTAGE', 'retry_deadline', fallback=30)
+
+        # every provider call is timed per endpoint; [QUOTE_SOURCE] routing = yes sends each request to the fastest
+        # provider whose circuit is closed, otherwise providers are asked in the order of intraday_providers
+        self.latency = LatencyStats()
+        self.router = SourceRouter(self.latency, failure_threshold=config.getint('QUOTE_SOURCE', 'circuit_failures', fallback=5),
+                                   reset_timeout=config.getfloat('QUOTE_SOURCE', 'circuit_reset', fallback=60),
+                                   timeout=config.getfloat('QUOTE_SOURCE', 'route_timeout', fallback=10))
+        self.routing = config.getboolean('QUOTE_SOURCE', 'routing', fallback=False)
+
+        # [QUOTE_SOURCE] hedge = yes asks the second provider for the same bars when the first has not answered within
+        # hedge_percentile of its recent latencies (hedge_delay seconds until enough samples are in)
+        self.hedge = config.getboolean('QUOTE_SOURCE', 'hedge', fallback=False)
+        self.hedge_percentile = config.getfloat('QUOTE_SOURCE', 'hedge_percentile', fallback=95)
+        self.hedge_delay = config.getfloat('QUOTE_SOURCE', 'hedge_delay', fallback=2)
+        self.hedge_metrics = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'primary_wins': 0, 'failed': 0}
+        self._hedge_lock = threading.Lock()
+        self.hedge_executor = None
+        if self.hedge:
+            self.hedge_executor = ThreadPoolExecutor(max_workers=2 * config.getint('QUOTE_SOURCE', 'max_workers', fallback=8))
+
+        # [QUOTE_SOURCE] resample = yes only downloads (and caches) 1m bars, 5m/15m/1h bars are built from them,
+        # aligned to the session open
+        self.resample = config.getboolean('QUOTE_SOURCE', 'resample', fallback=False)
+
+        # when each provider's intraday bars become available, see freshness.FreshnessTracker
+        self.freshness = freshness or FreshnessTracker(default_lag=config.getfloat('QUOTE_SOURCE', 'source_lag', fallback=10),
+                                                       max_wait=config.getfloat('QUOTE_SOURCE', 'max_source_lag', fallback=10),
+                                                       probe_interval=config.getfloat('QUOTE_SOURCE', 'probe_interval', fallback=1),
+                                                       calls_per_minute=config.getint('QUOTE_SOURCE', 'probe_calls_per_minute', fallback=5))
+
+    @property
+    def alpha(self):
+        return self.adapters.get('alphavantage')
+
+    @property
+    def iex(self):
+        return self.adapters.get('iex')
+
+    def _map_symbols(self, function, symbols):
+        # {symbol: function(symbol)}, a failing symbol gets a NaN bar instead of failing the others
+        def fetch(sym):
+            try:
+                return function(sym)
+            except Exception as e:
+                log.error("Error occurred while fetching quotes for (%s): %s " % (sym, e))
+                return _nan_bars()
+
+        if self.executor is None or len(symbols) <= 1:
+            return {sym: fetch(sym) for sym in symbols}
+
+        return dict(zip(symbols, self.executor.map(fetch, symbols)))
+
+    def fetch_intraday_quotes(self, symbol, since_last_quote_time=None, frequency='1m', field=None, outcomes=None):
+        # outcomes, when given, is filled with {symbol: FRESH | STALE | MISSING}
         if frequency not in ['1m', '5m', '15m', '1h']:
             log.warning("frequency used (%s) is not allowed, the allowable list includes (%s)" % (frequency, self.allowed_history_frequency))
             return None
 
         interval = "%smin" % self.allowed_history_frequency[frequency]
         if isinstance(symbol, str):
-            bars = self.alpha.get_quote_intraday(symbol=symbol, interval=interval, since_last_quote_time=since_last_quote_time)
-            ctr = 0
-            log.info("connected:%s" % bars.iloc[0]['connected'])
-            while len(bars) <= 1 and np.isnan(float(bars.iloc[0]['close'])) and not bars.iloc[0]['connected']:
-                log.info("got no quote (%s), trying again(%s)" % (bars, ctr))
-                if ctr >= 7:
-                    break
-                time.sleep(10)
-                bars = self.alpha.get_quote_intraday(symbol=symbol, interval=interval, since_last_quote_time=since_last_quote_time)
-                ctr = ctr+1
+            bars = self._fetch_intraday_bars(symbols=[symbol], interval=interval, since_last_quote_time=since_last_quote_time, wait_for_connection=True, outcomes=outcomes, fields=fetch_fields(field))[symbol]
             if field:
                 bars = bars[field]
 
             return bars
 
-        symbol_bars = {}
-        for sym in symbol:
-            bars = self.alpha.get_quote_intraday(symbol=sym, interval=interval, since_last_quote_time=since_last_quote_time)
-            ctr = 0
-            log.info("connected:%s" % bars.iloc[0]['connected'])
-            while len(bars) <= 1 and np.isnan(float(bars.iloc[0]['close'])) and not bars.iloc[0]['connected'] and 'yes' == self.config.get('ALPHA_VANTAGE', 'wait_for_connection'):
-                log.info("got no quote (%s), trying again(%s)" % (bars, ctr))
-                if ctr >= 7:
-                    break
-                time.sleep(10)
-                bars = self.alpha.get_quote_intraday(symbol=sym, interval=interval, since_last_quote_time=since_last_quote_time)
-                ctr = ctr+1
+        wait_for_connection = 'yes' == self.config.get('ALPHA_VANTAGE', 'wait_for_connection')
+        symbol_bars = self._fetch_intraday_bars(symbols=list(symbol), interval=interval, since_last_quote_time=since_last_quote_time, wait_for_connection=wait_for_connection, outcomes=outcomes, fields=fetch_fields(field))
+        if field:
+            for sym in symbol_bars:
+                symbol_bars[sym] = symbol_bars[sym][field]
 
-            if field:
-                bars = bars[field]
+        return symbol_bars
 
-            symbol_bars[sym] = bars
+    def _fetch_intraday_bars(self, symbols, interval, since_last_quote_time, wait_for_connection, outcomes=None, fields=None):
+        # symbols AlphaVantage is not connected for yet go to one deferred queue and are retried together,
+        # the others are done after the first round; only the bar columns in fields are built (all when None)
+        def fetch(sym):
+            if self.hedge:
+                providers = self.router.rank('intraday', self.intraday_providers) if self.routing else self.intraday_providers
+                bars = self._fetch_intraday_hedged(sym, interval, since_last_quote_time, providers[0], providers[1 % len(providers)], fields)
+            else:
+                # without routing IEX is not asked for today's bars, the history fills in the rest
+                providers = self.intraday_providers if self.routing else self.intraday_providers[:1]
+                sources = [(provider, partial(self._fetch_intraday_from, provider, sym, interval, since_last_quote_time, fields)) for provider in providers]
+                bars = self.router.call('intraday', sources, is_valid=_has_intraday_answer, route=self.routing)
+            log.info("connected:%s" % bars.iloc[0]['connected'])
+            return bars
+
+        symbol_bars = self._map_symbols(fetch, symbols)
+        retries = RetrySchedule(backoff=self.retry_backoff, deadline=self.retry_deadline)
+        if wait_for_connection:
+            for sym in symbols:
+                if intraday_outcome(symbol_bars[sym]) == MISSING:
+                    retries.defer(sym)
+
+        while len(retries) > 0:
+            time.sleep(retries.wait_time())
+            due = retries.pop_due()
+            if not due:
+                continue
+            log.info("got no quote for (%s), trying again" % due)
+            symbol_bars.update(self._map_symbols(fetch, due))
+            for sym in due:
+                if intraday_outcome(symbol_bars[sym]) == MISSING:
+                    retries.defer(sym)
+
+        if outcomes is not None:
+            for sym in symbols:
+                outcomes[sym] = intraday_outcome(symbol_bars[sym])
 
         return symbol_bars
 
-    def fetch_quotes(self, symbol, bar_count=1, frequency='1m', field=None, market_open=True, since_last_quote_time=None):
+    def _fetch_intraday_from(self, provider, symbol, interval, since_last_quote_time, fields=None):
+        minute_series = int(interval.replace("min", ""))
+        if provider != 'iex':
+            bars = self.adapters.get(provider).get_quote_intraday(symbol=symbol, interval=interval, since_last_quote_time=since_last_quote_time, fields=fields)
+            self.freshness.record(provider, symbol, minute_series, bars)
+            return bars
+
+        if not since_last_quote_time:
+            since_last_quote_time = datetime.now().replace(hour=8, minute=25, second=0, microsecond=0)
+
+        bars = self.iex.get_quote_intraday(symbol=symbol, minute_series=minute_series, last_quote_time=since_last_quote_time, fields=fields)
+        bars['connected'] = not np.isnan(float(bars.iloc[0]['close']))
+        self.freshness.record(provider, symbol, minute_series, bars)
+        return bars
+
+    def _fetch_intraday_hedged(self, symbol, interval, since_last_quote_time, primary_provider, secondary_provider, fields=None):
+        # the primary first, the secondary as well once the primary is slower than usual (or fails), first valid answer wins
+        def fetch_from(provider):
+            return self.router.timed_call(provider, 'intraday', partial(self._fetch_intraday_from, provider, symbol, interval, since_last_quote_time, fields), is_valid=_has_intraday_answer)
+
+        self._count_hedge('requests')
+        primary = self.hedge_executor.submit(fetch_from, primary_provider)
+        hedge_delay = self.hedge_delay
+        if self.latency.count(stats_key(primary_provider, 'intraday')) >= 20:
+            hedge_delay = self.latency.percentile(stats_key(primary_provider, 'intraday'), self.hedge_percentile)
+
+        futures = {primary: 'primary'}
+        done, pending = wait([primary], timeout=hedge_delay)
+        if primary in done and _is_valid_intraday(primary):
+            self._count_hedge('primary_wins')
+            return primary.result()
+
+        log.info("hedging intraday quote for (%s) on (%s) after %.2fs" % (symbol, secondary_provider, hedge_delay))
+        self._count_hedge('hedged')
+        secondary = self.hedge_executor.submit(fetch_from, secondary_provider)
+        futures[secondary] = 'secondary'
+        pending = set(pending) | {secondary}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if _is_valid_intraday(future):
+                    self._count_hedge('primary_wins' if futures[future] == 'primary' else 'hedge_wins')
+                    return future.result()
+
+        # neither answered with bars, the primary's answer (or error) stands
+        self._count_hedge('failed')
+        return primary.result()
+
+    def _count_hedge(self, name):
+        with self._hedge_lock:
+            self.hedge_metrics[name] = self.hedge_metrics[name] + 1
+
+    def hedge_stats(self):
+        with self._hedge_lock:
+            metrics = dict(self.hedge_metrics)
+        metrics['hedge_rate'] = metrics['hedged'] / float(metrics['requests']) if metrics['requests'] else 0.0
+        metrics['hedge_win_rate'] = metrics['hedge_wins'] / float(metrics['hedged']) if metrics['hedged'] else 0.0
+        metrics['latency'] = self.latency.stats()
+        return metrics
+
+    def source_stats(self):
+        return self.router.stats()
+
+    def fetch_quotes(self, symbol, bar_count=1, frequency='1m', field=None, market_open=True, since_last_quote_time=None, outcomes=None):
         # market_open = True
         if frequency not in self.allowed_history_frequency:
             log.warning("frequency used (%s) is not allowed, the allowable list includes (%s)" % (frequency, self.allowed_history_frequency))
             return None
 
         if isinstance(symbol, str):
-            return self._fetch_quotes_by_sym(symbol=symbol, bar_count=bar_count, frequency=frequency, field=field, market_open=market_open, since_last_quote_time=since_last_quote_time)
-
-        symbol_bars = {}
-        for sym in symbol:
-            symbol_bars[sym] = self._fetch_quotes_by_sym(symbol=sym, bar_count=bar_count, frequency=frequency, field=field, market_open=market_open, since_last_quote_time=since_last_quote_time)
+            return self._fetch_quotes_by_sym(symbol=symbol, bar_count=bar_count, frequency=frequency, field=field, market_open=market_open, since_last_quote_time=since_last_quote_time, outcomes=outcomes)
 
-        return symbol_bars
+        return self._fetch_quotes_by_syms(symbols=list(symbol), bar_count=bar_count, frequency=frequency, field=field, market_open=market_open, since_last_quote_time=since_last_quote_time, outcomes=outcomes)
 
-    def _fetch_quotes_by_sym(self, symbol, bar_count=1, frequency='1m', field=None, market_open=True, since_last_quote_time=None):
+    def _fetch_quotes_by_sym(self, symbol, bar_count=1, frequency='1m', field=None, market_open=True, since_last_quote_time=None, outcomes=None):
         if frequency not in self.allowed_history_frequency:
             log.warning("frequency used (%s) is not allowed, the allowable list includes (%s)" % (frequency, self.allowed_history_frequency))
             return None
@@ -120,11 +282,32 @@ class FriarTuckQuoteSource(QuoteSourceAbstract):
             log.warning("only for str symbol (%s)" % symbol)
             return None
 
+        return self._fetch_quotes_by_syms(symbols=[symbol], bar_count=bar_count, frequency=frequency, field=field, market_open=market_open, since_last_quote_time=since_last_quote_time, outcomes=outcomes)[symbol]
+
+    def _fetch_quotes_by_syms(self, symbols, bar_count=1, frequency='1m', field=None, market_open=True, since_last_quote_time=None, outcomes=None):
+        if self.resample and frequency in ['5m', '15m', '1h']:
+            minute_bars = self._fetch_quotes_by_syms(symbols=symbols, bar_count=self._resample_bar_count(bar_count, frequency), frequency='1m', field=fetch_fields(field), market_open=market_open, since_last_quote_time=since_last_quote_time, outcomes=outcomes)
+            return self._resample_symbol_bars(minute_bars, bar_count=bar_count, frequency=frequency, field=field)
+
         if frequency in ['1m', '5m', '15m', '1h']:
-            bars = None
-            before_date = None
+            symbol_bars = {}
             if market_open:
-                bars = self.fetch_intraday_quotes(symbol=symbol, frequency=frequency, field=None, since_last_quote_time=since_last_quote_time)
+                interval = "%smin" % self.allowed_history_frequency[frequency]
+                symbol_bars = self._fetch_intraday_bars(symbols=symbols, interval=interval, since_last_quote_time=since_last_quote_time, wait_for_connection=True, outcomes=outcomes, fields=fetch_fields(field))
+
+            return self._complete_intraday_bars(symbols=symbols, symbol_bars=symbol_bars, bar_count=bar_count, frequency=frequency, field=field)
+
+        return self._fetch_daily_bars(symbols=symbols, bar_count=bar_count, field=field)
+
+    def _complete_intraday_bars(self, symbols, symbol_bars, bar_count=1, frequency='1m', field=None):
+        # symbol_bars holds what AlphaVantage returned for today (if anything), IEX history fills in up to bar_count
+        fields = fetch_fields(field)
+        symbol_bars = dict(symbol_bars)
+        before_dates = {}
+        for symbol in symbols:
+            bars = symbol_bars.get(symbol)
+            before_date = None
+            if bars is not None:
                 # log.info("intra_bars:"+len(bars))
 
                 if len(bars) > 0 and not np.isnan(float(bars.iloc[0]['close'])):
@@ -133,22 +316,195 @@ class FriarTuckQuoteSource(QuoteSourceAbstract):
                 if len(bars) > 0 and np.isnan(float(bars.iloc[0]['close'])):
                     bars = bars.drop([bars.index[0]])
 
-            # log.info(bars)
-            if bars is None or len(bars) < bar_count:
-                new_bars = self.iex.get_quote_intraday_hist_by_bars(symbol=symbol, minute_series=self.allowed_history_frequency[frequency], bars=bar_count, before_date=before_date)
-                if bars is None:
-                    bars = new_bars
+            symbol_bars[symbol] = bars
+            before_dates[symbol] = before_date
+
+        # log.info(bars)
+        # the IEX history is fetched in batches of symbols sharing the same start day
+        backfill = {}
+        for symbol in symbols:
+            if symbol_bars[symbol] is None or len(symbol_bars[symbol]) < bar_count:
+                before_date = before_dates[symbol]
+                backfill.setdefault(before_date.date() if before_date else None, []).append(symbol)
+
+        history = self.adapters.get(self.history_provider) if backfill else None
+        for day_symbols in backfill.values():
+            before_date = before_dates[day_symbols[0]]
+            minute_series = self.allowed_history_frequency[frequency]
+            fetch_one = lambda sym: history.get_quote_intraday_hist_by_bars(symbol=sym, minute_series=minute_series, bars=bar_count, before_date=before_date, fields=fields)
+            if not hasattr(history, 'get_quote_intraday_hist_by_bars_batch'):
+                new_bars = self._map_symbols(fetch_one, day_symbols)
+            else:
+                try:
+                    new_bars = history.get_quote_intraday_hist_by_bars_batch(symbols=day_symbols, minute_series=minute_series, bars=bar_count, before_date=before_date, fields=fields)
+                except Exception as e:
+                    log.error("Error occurred while fetching batch history, fetching one symbol at a time: %s " % e)
+                    new_bars = self._map_symbols(fetch_one, day_symbols)
+            for symbol in day_symbols:
+                if symbol_bars[symbol] is None:
+                    symbol_bars[symbol] = new_bars[symbol]
                 else:
-                    bars = new_bars.append(bars)
+                    symbol_bars[symbol] = pd.concat([new_bars[symbol], symbol_bars[symbol]])
 
-            bars.sort_index(inplace=True)
+        for symbol in symbols:
+            symbol_bars[symbol].sort_index(inplace=True)
             if field:
-                bars = bars[field]
+                symbol_bars[symbol] = symbol_bars[symbol][field]
 
-            return bars
+        return symbol_bars
+
+    def _resample_bar_count(self, bar_count, frequency):
+        # a bar never spans more than minute_series 1m bars, one extra bar as the oldest one may be cut short
+        return (bar_count + 1) * self.allowed_history_frequency[frequency]
+
+    def _resample_symbol_bars(self, minute_bars, bar_count=1, frequency='5m', field=None):
+        symbol_bars = {}
+        for symbol, bars in minute_bars.items():
+            bars = resample_bars(bars, self.allowed_history_frequency[frequency], fields=fetch_fields(field)).tail(bar_count)
+            symbol_bars[symbol] = bars[field] if field else bars
+
+        return symbol_bars
+
+    def _fetch_daily_bars(self, symbols, bar_count=1, field=None):
+        sources = [(provider, partial(self._fetch_daily_from, provider, symbols, bar_count, fetch_fields(field))) for provider in self.daily_providers]
+        if not self.routing:
+            sources = sources[:1]
 
-        bars = self.iex.get_quote_daily(symbol=symbol, bars=bar_count)
+        symbol_bars = self.router.call('daily', sources, is_valid=_has_daily_answer, route=self.routing)
         if field:
-            bars = bars[field]
+            for symbol in symbols:
+                symbol_bars[symbol] = symbol_bars[symbol][field]
 
-        return bars
+        return symbol_bars
+
+    def _fetch_daily_from(self, provider, symbols, bar_count, fields=None):
+        adapter = self.adapters.get(provider)
+        fetch_one = lambda sym: adapter.get_quote_daily(symbol=sym, bars=bar_count, fields=fields)
+        if not hasattr(adapter, 'get_quote_daily_batch'):
+            return self._map_symbols(fetch_one, symbols)
+
+        try:
+            return adapter.get_quote_daily_batch(symbols=symbols, bars=bar_count, fields=fields)
+        except Exception as e:
+            log.error("Error occurred while fetching batch history, fetching one symbol at a time: %s " % e)
+            return self._map_symbols(fetch_one, symbols)
+
+
+class RetrySchedule(object):
+    """Deferred retry queue shared by every symbol of a fetch: exponential backoff per symbol, one overall deadline."""
+
+    def __init__(self, backoff=2, deadline=30, max_retries=7):
+        self.backoff = backoff
+        self.deadline = time.time() + deadline
+        self.max_retries = max_retries
+        self._queue = []
+        self._retries = {}
+
+    def defer(self, symbol):
+        retries = self._retries.get(symbol, 0)
+        due = time.time() + self.backoff * (2 ** retries)
+        if retries >= self.max_retries or due > self.deadline:
+            return False
+
+        self._retries[symbol] = retries + 1
+        heapq.heappush(self._queue, (due, symbol))
+        return True
+
+    def wait_time(self):
+        return max(0, self._queue[0][0] - time.time())
+
+    def pop_due(self):
+        now = time.time()
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            due.append(heapq.heappop(self._queue)[1])
+        return due
+
+    def __len__(self):
+        return len(self._queue)
+
+
+def intraday_outcome(bars):
+    # FRESH: new bars since the last quote, STALE: AlphaVantage answered with nothing newer, MISSING: no answer
+    if bars is None or len(bars) == 0:
+        return MISSING
+    if len(bars) <= 1 and np.isnan(float(bars.iloc[0]['close'])):
+        return STALE if bars.iloc[0].get('connected', False) else MISSING
+    return FRESH
+
+
+def resample_bars(bars, minute_series, session_open=8 * 60 + 30, fields=None):
+    """Aggregates 1m bars into bars of minute_series minutes, each starting session_open + k * minute_series minutes
+    into its day (local time) and labelled with that start. Only the columns in fields (all when None) are built."""
+    bars = bars[~np.isnan(bars['close'].values.astype(np.float64))]
+    if len(bars) == 0:
+        return _nan_bars()
+
+    fields = BAR_FIELDS if fields is None else [name for name in BAR_FIELDS if name in fields]
+    times = bars.index.values.astype('datetime64[m]')
+    days = times.astype('datetime64[D]')
+    day_minutes = (times - days).astype(np.int64)
+    periods = (day_minutes - session_open) // minute_series
+    keys = days.astype(np.int64) * (24 * 60) + periods
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = np.concatenate((starts[1:], [len(keys)])) - 1
+
+    closes = bars['close'].values.astype(np.float64)
+    bar_dates = pd.DatetimeIndex(days[starts] + (session_open + periods[starts] * minute_series).astype('timedelta64[m]'))
+    data = {'price': closes[ends], 'close': closes[ends], 'date': bar_dates}
+    if 'open' in fields:
+        data['open'] = bars['open'].values.astype(np.float64)[starts]
+    if 'high' in fields:
+        data['high'] = np.fmax.reduceat(bars['high'].values.astype(np.float64), starts)
+    if 'low' in fields:
+        data['low'] = np.fmin.reduceat(bars['low'].values.astype(np.float64), starts)
+    if 'volume' in fields:
+        data['volume'] = np.add.reduceat(np.nan_to_num(bars['volume'].values.astype(np.float64)).astype(np.int64), starts)
+
+    return pd.DataFrame(index=bar_dates, columns=fields, data={field: data[field] for field in fields})
+
+
+def fetch_fields(field):
+    """The bar columns to build for a history/current field (a name, a list of names or None for every column).
+
+    close and date are always built, the checks on the bars and the IEX backfill rely on them."""
+    if not field:
+        return None
+    fields = [field] if isinstance(field, str) else list(field)
+    return [name for name in BAR_FIELDS if name in fields or name in ['close', 'date']]
+
+
+def _provider_list(value, default):
+    # "alphavantage, iex" -> ['alphavantage', 'iex']
+    if not value:
+        return list(default)
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def _is_valid_intraday(future):
+    if future.exception() is not None:
+        log.error("Error occurred while fetching quotes: %s " % future.exception())
+        return False
+    return _has_intraday_answer(future.result())
+
+
+def _has_intraday_answer(bars):
+    # fresh bars, or the provider answered that there is nothing newer
+    return intraday_outcome(bars) != MISSING
+
+
+def _has_daily_answer(symbol_bars):
+    return any(len(bars) > 0 and not np.isnan(float(bars.iloc[-1]['close'])) for bars in symbol_bars.values())
+
+
+def _nan_bars():
+    quote_date = datetime.now()
+    quote_date = quote_date.replace(second=0, microsecond=0)
+    return pd.DataFrame(index=pd.DatetimeIndex([quote_date]), columns=['price', 'open', 'high', 'low', 'close', 'volume', 'date'],
+                        data={'price': float("nan"),
+                              'open': float("nan"),
+                              'high': float("nan"),
+                              'low': float("nan"),
+                              'close': float("nan"),
+                              'volume': int(0),
+                              'date': quote_date})
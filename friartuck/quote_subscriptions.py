@@ -0,0 +1,189 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from friartuck import utc_to_local
+
+log = logging.getLogger("friar_tuck")
+
+# Robinhood quote fields read for current(), and the most symbols asked in one quotes request
+QUOTE_KEYS = 'symbol,last_trade_price,bid_price,bid_size,ask_price,ask_size,updated_at'
+MAX_QUOTE_SYMBOLS = 50
+
+# updated_at is Robinhood's (local) time of the quote, received_at when it was read
+LatestQuote = namedtuple('LatestQuote', ['symbol', 'price', 'bid_price', 'bid_size', 'ask_price', 'ask_size', 'updated_at', 'received_at'])
+
+
+class QuoteSubscriptions(object):
+    """Latest Robinhood quote of every subscribed symbol, polled in the background.
+
+    The algo and the engine (for the held positions) subscribe symbols under their own name, a worker thread asks
+    Robinhood for all of them every interval seconds in MAX_QUOTE_SYMBOLS batches and only writes the quotes whose
+    updated_at changed. Readers take latest() without a lock: each quote is an immutable LatestQuote swapped into
+    the table whole, the time of the poll that last saw a symbol tells how stale the table is for it.
+    """
+
+    def __init__(self, rh_session, interval=5, executor=None):
+        self.rh_session = rh_session
+        self.interval = interval
+        self.executor = executor
+        self.counts = {'polls': 0, 'requests': 0, 'updated': 0, 'unchanged': 0, 'unquoted': 0}
+        self._subscribers = {}
+        self._quotes = {}
+        self._seen_at = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def subscribe(self, symbols, subscriber='algo'):
+        with self._lock:
+            for symbol in symbols:
+                self._subscribers.setdefault(symbol.upper(), set()).add(subscriber)
+
+    def unsubscribe(self, symbols, subscriber='algo'):
+        with self._lock:
+            for symbol in symbols:
+                subscribers = self._subscribers.get(symbol.upper())
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        self._subscribers.pop(symbol.upper())
+
+    def set_subscriptions(self, symbols, subscriber):
+        # exactly symbols for subscriber, e.g. the positions held after each profile load
+        symbols = set(symbol.upper() for symbol in symbols)
+        with self._lock:
+            for symbol in list(self._subscribers):
+                if symbol not in symbols and subscriber in self._subscribers[symbol]:
+                    self._subscribers[symbol].discard(subscriber)
+                    if not self._subscribers[symbol]:
+                        self._subscribers.pop(symbol)
+            for symbol in symbols:
+                self._subscribers.setdefault(symbol, set()).add(subscriber)
+
+    def symbols(self):
+        with self._lock:
+            return sorted(self._subscribers)
+
+    def latest(self, symbol, max_age=None):
+        """The latest quote of symbol, None when it was never polled or (with max_age) no poll saw it in max_age seconds."""
+        symbol = symbol.upper()
+        quote = self._quotes.get(symbol)
+        if quote is None:
+            return None
+        if max_age is not None and self._seen_at.get(symbol, quote.received_at) < datetime.now() - timedelta(seconds=max_age):
+            return None
+        return quote
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='quote_subscriptions')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        log.info("**** polling quotes every %ss" % self.interval)
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                log.error("Error occurred while polling quotes: %s " % e)
+            self._stop.wait(self.interval)
+
+    def poll(self):
+        symbols = self.symbols()
+        if not symbols:
+            return
+
+        chunk_count = (len(symbols) + MAX_QUOTE_SYMBOLS - 1) // MAX_QUOTE_SYMBOLS
+        quotes = fetch_latest_quotes(self.rh_session, symbols, self.executor)
+        seen_at = datetime.now()
+        updated = 0
+        for symbol, quote in quotes.items():
+            previous = self._quotes.get(symbol)
+            if previous is None or previous.updated_at != quote.updated_at:
+                self._quotes[symbol] = quote
+                updated = updated + 1
+            self._seen_at[symbol] = seen_at
+
+        with self._lock:
+            self.counts['polls'] = self.counts['polls'] + 1
+            self.counts['requests'] = self.counts['requests'] + chunk_count
+            self.counts['updated'] = self.counts['updated'] + updated
+            self.counts['unchanged'] = self.counts['unchanged'] + len(quotes) - updated
+            self.counts['unquoted'] = self.counts['unquoted'] + len(symbols) - len(quotes)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, symbols=len(self._subscribers), quotes=len(self._quotes))
+
+
+def fetch_latest_quotes(rh_session, symbols, executor=None):
+    """{SYMBOL: LatestQuote} of the symbols Robinhood quoted, asked MAX_QUOTE_SYMBOLS at a time (the batches in
+    parallel on executor when given)."""
+    chunks = [",".join(symbols[i:i + MAX_QUOTE_SYMBOLS]) for i in range(0, len(symbols), MAX_QUOTE_SYMBOLS)]
+
+    def fetch(chunk):
+        try:
+            return rh_session.get_quote_list(chunk, QUOTE_KEYS)
+        except Exception as e:
+            log.error("Error occurred while fetching quotes for (%s): %s " % (chunk, e))
+            return []
+
+    if executor is None or len(chunks) <= 1:
+        quote_lists = [fetch(chunk) for chunk in chunks]
+    else:
+        quote_lists = list(executor.map(fetch, chunks))
+
+    received_at = datetime.now()
+    return {row[0].upper(): latest_quote(row, received_at) for quote_list in quote_lists for row in quote_list}
+
+
+def latest_quote(row, received_at):
+    # row: the QUOTE_KEYS values as get_quote_list returns them (strings, 'None' when Robinhood had none)
+    try:
+        updated_at = utc_to_local(datetime.strptime(row[6][:19], "%Y-%m-%dT%H:%M:%S"))
+    except ValueError:
+        updated_at = None
+    return LatestQuote(row[0].upper(), _to_float(row[1]), _to_float(row[2]), _to_float(row[3]), _to_float(row[4]), _to_float(row[5]), updated_at, received_at)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
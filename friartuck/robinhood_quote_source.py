@@ -0,0 +1,153 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dateutil import tz
+
+from friartuck.Robinhood import Robinhood
+from friartuck.quote_source import QuoteSourceAbstract, BAR_FIELDS, fetch_fields, resample_bars, _nan_bars
+
+log = logging.getLogger("friar_tuck")
+
+# most symbols sent in one historicals request
+MAX_BATCH_SYMBOLS = 75
+# 5m bars of one regular session
+SESSION_BARS = 78
+
+
+def from_config(config):
+    # a session of its own, FriarTuckLive registers an adapter on its already logged in session instead
+    rh_session = Robinhood()
+    rh_session.login(username=config.get('LOGIN', 'username'), password=config.get('LOGIN', 'password'))
+    return RobinhoodQuoteSource(rh_session)
+
+
+class RobinhoodQuoteSource(QuoteSourceAbstract):
+    """Quote source on the Robinhood historicals endpoint, a whole universe of symbols (MAX_BATCH_SYMBOLS per request)
+    at a time: 5m bars of the last week (15m/1h are built from them) and daily bars of up to five years.
+
+    Also usable as the history_provider or one of the daily_providers of FriarTuckQuoteSource.
+    """
+    allowed_history_frequency = {'5m': 5, '15m': 15, '1h': 60, '1d': 1}
+
+    def __init__(self, rh_session):
+        self.rh_session = rh_session
+
+    def fetch_quotes(self, symbol, bar_count=1, frequency='5m', field=None, market_open=True, since_last_quote_time=None, outcomes=None):
+        if frequency not in self.allowed_history_frequency:
+            log.warning("frequency used (%s) is not allowed, the allowable list includes (%s)" % (frequency, self.allowed_history_frequency))
+            return None
+
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        if frequency == '1d':
+            symbol_bars = self.get_quote_daily_batch(symbols=symbols, bars=bar_count, fields=fetch_fields(field))
+        else:
+            symbol_bars = self.get_quote_intraday_hist_by_bars_batch(symbols=symbols, minute_series=self.allowed_history_frequency[frequency], bars=bar_count, fields=fetch_fields(field))
+
+        for sym in symbols:
+            if since_last_quote_time is not None:
+                symbol_bars[sym] = symbol_bars[sym][symbol_bars[sym].index > since_last_quote_time]
+            if field:
+                symbol_bars[sym] = symbol_bars[sym][field]
+
+        if isinstance(symbol, str):
+            return symbol_bars[symbol]
+
+        return symbol_bars
+
+    def fetch_intraday_quotes(self, symbol, since_last_quote_time=None, frequency='5m', field=None):
+        if not since_last_quote_time:
+            since_last_quote_time = datetime.now().replace(hour=8, minute=25, second=0, microsecond=0)
+        return self.fetch_quotes(symbol=symbol, bar_count=SESSION_BARS, frequency=frequency, field=field, since_last_quote_time=since_last_quote_time)
+
+    def get_quote_intraday_hist_by_bars(self, symbol, minute_series, bars=1, before_date=None, fields=None):
+        return self.get_quote_intraday_hist_by_bars_batch([symbol], minute_series, bars, before_date, fields)[symbol]
+
+    def get_quote_intraday_hist_by_bars_batch(self, symbols, minute_series, bars=1, before_date=None, fields=None):
+        # like IEXTrading: the last bars of the days before before_date (today included when None)
+        if minute_series not in [5, 15, 60]:
+            raise ValueError("Robinhood historicals have no %s minute bars" % minute_series)
+
+        symbol_bars = self._get_historicals(symbols, '5minute', 'week', fields)
+        for symbol in symbols:
+            my_bars = symbol_bars[symbol]
+            if before_date is not None:
+                my_bars = my_bars[my_bars.index < pd.Timestamp(before_date.date())]
+            if minute_series != 5 and len(my_bars) > 0:
+                my_bars = resample_bars(my_bars, minute_series, fields=fields)
+            symbol_bars[symbol] = _tail_or_nan(my_bars, bars, fields)
+
+        return symbol_bars
+
+    def get_quote_daily(self, symbol, bars=22, fields=None):
+        return self.get_quote_daily_batch([symbol], bars, fields)[symbol]
+
+    def get_quote_daily_batch(self, symbols, bars=22, fields=None):
+        symbol_bars = self._get_historicals(symbols, 'day', 'year' if bars <= 250 else '5year', fields, daily=True)
+        return {symbol: _tail_or_nan(symbol_bars[symbol], bars, fields) for symbol in symbols}
+
+    def _get_historicals(self, symbols, interval, span, fields=None, daily=False):
+        symbol_bars = {}
+        for i in range(0, len(symbols), MAX_BATCH_SYMBOLS):
+            chunk = symbols[i:i + MAX_BATCH_SYMBOLS]
+            data = self.rh_session.get_historical_quotes([symbol.upper() for symbol in chunk], interval, span)
+            results = {result['symbol'].upper(): result for result in (data or {}).get('results') or [] if result}
+            for symbol in chunk:
+                symbol_bars[symbol] = historical_bars(results.get(symbol.upper(), {}).get('historicals') or [], fields, daily)
+
+        return symbol_bars
+
+
+def historical_bars(historicals, fields=None, daily=False):
+    """The bar frame of a Robinhood historicals list, begins_at converted from UTC to local time (the day for daily
+    bars). Only the columns in fields (a fetch_fields list) are built, all when None."""
+    fields = fields or BAR_FIELDS
+    if len(historicals) == 0:
+        return pd.DataFrame(columns=fields)
+
+    begins_at = pd.DatetimeIndex(pd.to_datetime([bar['begins_at'] for bar in historicals], format="%Y-%m-%dT%H:%M:%SZ"))
+    if daily:
+        bar_dates = begins_at.normalize()
+    else:
+        bar_dates = begins_at.tz_localize('UTC').tz_convert(tz.tzlocal()).tz_localize(None)
+
+    data = {'date': bar_dates}
+    data['close'] = data['price'] = np.array([bar['close_price'] for bar in historicals], dtype=np.float64)
+    for name, key in [('open', 'open_price'), ('high', 'high_price'), ('low', 'low_price')]:
+        if name in fields:
+            data[name] = np.array([bar[key] for bar in historicals], dtype=np.float64)
+    if 'volume' in fields:
+        data['volume'] = np.array([bar['volume'] for bar in historicals], dtype=np.int64)
+
+    return pd.DataFrame(index=bar_dates, columns=fields, data={name: data[name] for name in fields})
+
+
+def _tail_or_nan(bars, bar_count, fields):
+    if len(bars) == 0:
+        return _nan_bars()[fields] if fields else _nan_bars()
+    return bars.tail(bar_count)
@@ -0,0 +1,220 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from friartuck.freshness import INTRADAY_MINUTES, last_boundary
+from friartuck.history_panel import PANEL_FIELDS
+from friartuck.quote_source import _nan_bars, FRESH, STALE, MISSING
+from friartuck.striped_lock import StripedLock
+
+log = logging.getLogger("friar_tuck")
+
+
+class RollingWindow(object):
+    """The latest capacity bars of one (symbol, frequency), PANEL_FIELDS columns of float64, in a preallocated ring.
+
+    Every row is written twice, at position and position + capacity, so the latest n rows are always one contiguous
+    slice and tail() copies them out in one go.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.values = np.full((2 * capacity, len(PANEL_FIELDS)), np.nan)
+        self.times = np.full(2 * capacity, np.datetime64('NaT'), dtype='datetime64[ns]')
+        self.count = 0
+        self._head = 0
+
+    @property
+    def last_time(self):
+        if self.count == 0:
+            return None
+        return pd.Timestamp(self.times[self._head + self.capacity - 1]).to_pydatetime()
+
+    def append(self, bars):
+        # the bars (a fetch_quotes frame) with a close and not older than the last one held, a bar with the last one's
+        # time replaces it (the bar was still in progress); returns how many went in
+        times = bars.index.values.astype('datetime64[ns]')
+        values = bars[PANEL_FIELDS].values.astype(np.float64)
+        keep = ~np.isnan(values[:, PANEL_FIELDS.index('close')])
+        if self.count > 0:
+            keep = keep & (times >= self.times[self._head + self.capacity - 1])
+
+        for time, row in zip(times[keep], values[keep]):
+            if self.count > 0 and time == self.times[self._head + self.capacity - 1]:
+                last = (self._head - 1) % self.capacity
+                self.values[last] = row
+                self.values[last + self.capacity] = row
+                continue
+
+            self.values[self._head] = row
+            self.values[self._head + self.capacity] = row
+            self.times[self._head] = time
+            self.times[self._head + self.capacity] = time
+            self._head = (self._head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+        return int(keep.sum())
+
+    def tail(self, bar_count):
+        # a bars frame of the latest bar_count bars, a copy: later appends write over the ring
+        end = self._head + self.capacity
+        start = end - min(bar_count, self.count)
+        return pd.DataFrame(self.values[start:end].copy(), index=pd.DatetimeIndex(self.times[start:end]), columns=PANEL_FIELDS)
+
+
+class RollingWindowStore(object):
+    """Serves data.history out of a RollingWindow per (symbol, frequency), sized to the largest bar_count asked.
+
+    A window is fetched whole once (again when a larger bar_count comes, or when more than one bar went by since its
+    last bar), after that each new bar_time only asks the quote source for the last bar held and the ones after it
+    (since_last_quote_time), so steady-state calls move a bar or two. A window holding fewer bars than asked (its seed
+    failed or came up short) is fetched whole again, once per bar_time. Bars come as float64 PANEL_FIELDS (and date)
+    columns. Fetches lock only the (symbol, frequency) windows they bring up to date.
+    """
+
+    def __init__(self, quote_source):
+        self.quote_source = quote_source
+        self.counts = {'seeded': 0, 'updates': 0, 'appended': 0, 'served': 0}
+        self._windows = {}
+        self._updated = {}
+        self._outcomes = {}
+        self._lock = threading.Lock()
+        self._window_locks = StripedLock()
+
+    def fetch(self, symbols, bar_count=1, frequency='1d', field=None, market_open=True, bar_time=None, outcomes=None):
+        """{symbol: bars} like quote_source.fetch_quotes, the windows are brought up to date once per bar_time.
+        outcomes, when given, is filled with {symbol: FRESH | STALE | MISSING}, STALE when the last update failed."""
+        with self._window_locks.locked([(symbol, frequency) for symbol in symbols]):
+            now = bar_time or datetime.now()
+            seed = [symbol for symbol in symbols if self._needs_seed(symbol, bar_count, frequency, bar_time, now)]
+            update = [symbol for symbol in symbols if symbol not in seed and self._updated.get((symbol, frequency)) != bar_time]
+            if seed:
+                self._seed(seed, bar_count, frequency, market_open)
+            if update:
+                self._update(update, frequency, market_open)
+            for symbol in seed + update:
+                self._updated[(symbol, frequency)] = bar_time
+
+            self._count('served')
+            fields = [field] if isinstance(field, str) else field
+            symbol_bars = {}
+            for symbol in symbols:
+                window = self._windows[(symbol, frequency)]
+                if outcomes is not None:
+                    outcomes[symbol] = MISSING if window.count == 0 else self._outcomes.get((symbol, frequency), FRESH)
+                if window.count == 0:
+                    # no quotes for the symbol, the placeholder bar of the quote source
+                    bars = _nan_bars()
+                else:
+                    bars = window.tail(bar_count)
+                    if not fields or 'date' in fields:
+                        bars['date'] = bars.index
+                symbol_bars[symbol] = bars[field] if field else bars
+
+            return symbol_bars
+
+    def _needs_seed(self, symbol, bar_count, frequency, bar_time, now):
+        window = self._windows.get((symbol, frequency))
+        if window is None or window.capacity < bar_count or _has_gap(window.last_time, frequency, now):
+            return True
+        # short of bars (a failed or partial seed), fetched whole again with the next bar
+        short = window.last_time is None or window.count < min(bar_count, window.capacity)
+        return short and self._updated.get((symbol, frequency)) != bar_time
+
+    def _seed(self, symbols, bar_count, frequency, market_open):
+        # the whole window, as wide as the widest one these symbols had; a failed fetch leaves them empty
+        capacity = max([bar_count] + [self._windows[(symbol, frequency)].capacity for symbol in symbols if (symbol, frequency) in self._windows])
+        fetch_outcomes = {}
+        try:
+            symbol_bars = self.quote_source.fetch_quotes(symbol=symbols, bar_count=capacity, frequency=frequency, market_open=market_open, outcomes=fetch_outcomes)
+        except Exception as e:
+            log.error("Error occurred while fetching the history windows of (%s): %s " % (symbols, e))
+            symbol_bars = {}
+
+        for symbol in symbols:
+            window = RollingWindow(capacity)
+            if symbol_bars.get(symbol) is not None:
+                window.append(symbol_bars[symbol])
+            with self._lock:
+                self._windows[(symbol, frequency)] = window
+                self._outcomes[(symbol, frequency)] = fetch_outcomes.get(symbol, FRESH)
+            self._count('seeded')
+
+    def _update(self, symbols, frequency, market_open):
+        # the oldest last bar of these symbols and the ones after it (no more than one bar went by, see _has_gap),
+        # each window keeps the ones from its own last bar on
+        windows = [self._windows[(symbol, frequency)] for symbol in symbols]
+        last_times = [window.last_time for window in windows if window.last_time is not None]
+        since_last_quote_time = None
+        if last_times and frequency != '1d':
+            since_last_quote_time = min(last_times) - timedelta(minutes=self.quote_source.allowed_history_frequency[frequency])
+
+        fetch_outcomes = {}
+        try:
+            symbol_bars = self.quote_source.fetch_quotes(symbol=symbols, bar_count=2, frequency=frequency, market_open=market_open, since_last_quote_time=since_last_quote_time, outcomes=fetch_outcomes)
+        except Exception as e:
+            log.error("Error occurred while updating the history windows of (%s), serving the bars held: %s " % (symbols, e))
+            for symbol in symbols:
+                self._outcomes[(symbol, frequency)] = STALE
+            return
+
+        self._count('updates')
+        for symbol, window in zip(symbols, windows):
+            if symbol_bars.get(symbol) is not None:
+                self._count('appended', window.append(symbol_bars[symbol]))
+                # bars held but none came in, the window is as old as its last update
+                self._outcomes[(symbol, frequency)] = STALE if fetch_outcomes.get(symbol) == MISSING else fetch_outcomes.get(symbol, FRESH)
+            else:
+                self._outcomes[(symbol, frequency)] = STALE
+
+    def _count(self, name, count=1):
+        with self._lock:
+            self.counts[name] = self.counts[name] + count
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, windows=len(self._windows))
+
+
+def _has_gap(last_time, frequency, now):
+    # more than one bar between the last bar held and the latest one, the window is fetched whole again
+    if last_time is None:
+        return False
+    if frequency == '1d':
+        return np.busday_count(last_time.date(), now.date()) > 1
+
+    minute_series = INTRADAY_MINUTES[frequency]
+    session_open = now.replace(hour=8, minute=30, second=0, microsecond=0)
+    if not np.is_busday(now.date()) or now < session_open + timedelta(minutes=2 * minute_series):
+        # no more than one bar of today yet, the last one held is of the previous session
+        return np.busday_count(last_time.date(), now.date()) > 1
+
+    session_close = now.replace(hour=15, minute=0, second=0, microsecond=0)
+    return last_time < last_boundary(min(now, session_close), minute_series) - timedelta(minutes=2 * minute_series)
@@ -0,0 +1,190 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger("friar_tuck")
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class NoProviderAvailable(Exception):
+    """Every provider of an endpoint refused the call (their circuits are open)."""
+
+
+class CircuitBreaker(object):
+    """Opens after failure_threshold failures in a row, lets one trial call through after reset_timeout seconds."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                # one trial call per reset_timeout until one succeeds
+                self.state = HALF_OPEN
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def available(self):
+        # whether allow() would let a call through, without taking the trial call of an open circuit
+        with self._lock:
+            return self.state == CLOSED or time.time() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures = self.failures + 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+
+
+class SourceRouter(object):
+    """Sends each request to the fastest healthy provider of an endpoint, falling through to the next one on failure.
+
+    Latency and failures are tracked per provider and endpoint in the shared LatencyStats, a circuit breaker per
+    provider stops calling it while it keeps failing. A call slower than timeout seconds counts as a failure.
+    """
+
+    def __init__(self, latency, failure_threshold=5, reset_timeout=60, timeout=10, min_samples=5):
+        self.latency = latency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.min_samples = min_samples
+        self.breakers = {}
+        self.routed = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, provider):
+        with self._lock:
+            if provider not in self.breakers:
+                self.breakers[provider] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[provider]
+
+    def rank(self, endpoint, providers):
+        """The providers worth calling for endpoint, fastest first; the ones not timed enough yet keep their
+        configured order ahead of the others so that they get measured."""
+        def latency(provider):
+            key = stats_key(provider, endpoint)
+            if self.latency.count(key) < self.min_samples:
+                return -1
+            return self.latency.percentile(key, 50)
+
+        healthy = [provider for provider in providers if self.breaker(provider).available()]
+        if not healthy:
+            # every circuit is open, still better to try than to have nothing
+            healthy = list(providers)
+        return sorted(healthy, key=lambda provider: (latency(provider), providers.index(provider)))
+
+    def call(self, endpoint, sources, is_valid=None, route=True):
+        """sources: list of (provider, function) in order of preference, returns function()'s result of the first
+        provider that answers validly, ranked unless route is False. Raises the last error when every provider failed,
+        NoProviderAvailable when none was called (a circuit can open, or take its trial call, between rank and allow)."""
+        functions = dict(sources)
+        providers = [provider for provider, _ in sources]
+        # when every circuit is open they are all tried anyway, see rank()
+        all_open = route and not any(self.breaker(provider).available() for provider in providers)
+        if route:
+            providers = self.rank(endpoint, providers)
+
+        result = None
+        error = None
+        called = False
+        for provider in providers:
+            # only the provider actually tried takes its trial call
+            if route and not all_open and not self.breaker(provider).allow():
+                continue
+            called = True
+            try:
+                result = self.timed_call(provider, endpoint, functions[provider], is_valid)
+            except Exception as e:
+                log.error("Error occurred while fetching %s from (%s): %s " % (endpoint, provider, e))
+                error = e
+                continue
+
+            if is_valid is None or is_valid(result):
+                with self._lock:
+                    self.routed[stats_key(provider, endpoint)] = self.routed.get(stats_key(provider, endpoint), 0) + 1
+                return result
+
+        if not called:
+            raise NoProviderAvailable("no provider of %s is available, circuits open: %s" % (endpoint, providers))
+        if result is None and error is not None:
+            raise error
+
+        return result
+
+    def timed_call(self, provider, endpoint, function, is_valid=None):
+        """function(), timed and counted against provider's circuit: an error, an invalid answer or an answer
+        slower than timeout are failures."""
+        start = time.time()
+        try:
+            result = function()
+        except Exception:
+            self.record(provider, endpoint, time.time() - start, ok=False)
+            raise
+
+        self.record(provider, endpoint, time.time() - start, ok=is_valid is None or is_valid(result))
+        return result
+
+    def record(self, provider, endpoint, elapsed, ok=True):
+        """Counts a call of provider timed by the caller (as timed_call does), slower than timeout is a failure."""
+        ok = ok and elapsed <= self.timeout
+        self.latency.record(stats_key(provider, endpoint), elapsed, ok=ok)
+        if ok:
+            self.breaker(provider).record_success()
+        else:
+            self.breaker(provider).record_failure()
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self.breakers)
+            routed = dict(self.routed)
+        return {'breakers': {provider: breaker.state for provider, breaker in breakers.items()}, 'routed': routed,
+                'latency': self.latency.stats()}
+
+    def __str__(self):
+        return str(self.stats())
+
+
+def stats_key(provider, endpoint):
+    return "%s/%s" % (provider, endpoint)
@@ -0,0 +1,193 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from friartuck.freshness import last_boundary
+from friartuck.history_planner import covers_window, widen_window
+from friartuck.quote_source import QuoteSourceAbstract, fetch_fields, FRESH, STALE, MISSING, _nan_bars
+
+log = logging.getLogger("friar_tuck")
+
+
+class StaleWhileRevalidateQuoteSource(QuoteSourceAbstract):
+    """Serves fetch_quotes out of the last good bars of each (symbol, frequency) and refreshes them in the background.
+
+    An entry is fresh until the next bar boundary (plus grace seconds for the provider to publish the bar), daily
+    bars until the session closes (8:30-15:00 local) or, out of it, until the next one opens. Past it
+    the entry is still returned right away, flagged STALE in outcomes, while one background fetch per call refreshes
+    every stale symbol. Past max_stale more seconds it is hard-expired: the call waits for the refresh, but no longer
+    than block_budget seconds, and falls back on the stale bars. A failed or empty refresh keeps the last good bars.
+    Symbols never fetched (or asked for more bars/fields than cached) block on the fetch like an uncached call.
+    """
+
+    def __init__(self, quote_source, grace=10, max_stale=60, block_budget=2.0, max_workers=2):
+        self.quote_source = quote_source
+        self.allowed_history_frequency = quote_source.allowed_history_frequency
+        self.grace = grace
+        self.max_stale = max_stale
+        self.block_budget = block_budget
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.counts = {FRESH: 0, STALE: 0, MISSING: 0, 'blocked': 0, 'budget_exceeded': 0, 'refreshes': 0, 'refresh_failures': 0}
+        self._entries = {}
+        self._refreshing = {}
+        self._lock = threading.Lock()
+
+    def fetch_intraday_quotes(self, symbol, since_last_quote_time=None, frequency='1m', field=None, outcomes=None):
+        return self.quote_source.fetch_intraday_quotes(symbol=symbol, since_last_quote_time=since_last_quote_time, frequency=frequency, field=field, outcomes=outcomes)
+
+    def fetch_quotes(self, symbol, bar_count=1, frequency='1m', field=None, market_open=True, since_last_quote_time=None, outcomes=None):
+        # outcomes, when given, is filled with {symbol: FRESH | STALE | MISSING}
+        if frequency not in self.allowed_history_frequency or since_last_quote_time is not None:
+            return self.quote_source.fetch_quotes(symbol=symbol, bar_count=bar_count, frequency=frequency, field=field, market_open=market_open, since_last_quote_time=since_last_quote_time, outcomes=outcomes)
+
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        fields = fetch_fields(field)
+        now = datetime.now()
+        blocking = []
+        budgeted = []
+        refresh = []
+        with self._lock:
+            for sym in symbols:
+                entry = self._entries.get((sym, frequency))
+                if not covers_window(entry, bar_count, fields):
+                    blocking.append(sym)
+                    refresh.append((sym, widen_window(entry, bar_count, fields)))
+                elif now >= entry[3]:
+                    refresh.append((sym, entry[:2]))
+                    if now >= entry[3] + timedelta(seconds=self.max_stale):
+                        budgeted.append(sym)
+
+            futures = self._refresh(refresh, frequency, market_open)
+            self.counts['blocked'] = self.counts['blocked'] + len(blocking)
+
+        if blocking:
+            wait([futures[sym] for sym in blocking])
+        if budgeted:
+            done, not_done = wait([futures[sym] for sym in budgeted], timeout=self.block_budget)
+            if not_done:
+                log.warning("refresh of (%s) %s bars not done within %ss, serving stale bars" % (budgeted, frequency, self.block_budget))
+                with self._lock:
+                    self.counts['budget_exceeded'] = self.counts['budget_exceeded'] + 1
+
+        now = datetime.now()
+        symbol_bars = {}
+        with self._lock:
+            for sym in symbols:
+                entry = self._entries.get((sym, frequency))
+                if entry is None:
+                    # nothing good was ever fetched, the placeholder the quote source answered with
+                    bars = futures[sym].result().get(sym)
+                    bars = _nan_bars() if bars is None else bars
+                    outcome = MISSING
+                else:
+                    bars = entry[2].tail(bar_count)
+                    outcome = FRESH if now < entry[3] else STALE
+                symbol_bars[sym] = bars[field] if field else bars.copy()
+                self.counts[outcome] = self.counts[outcome] + 1
+                if outcomes is not None:
+                    outcomes[sym] = outcome
+
+        if isinstance(symbol, str):
+            return symbol_bars[symbol]
+
+        return symbol_bars
+
+    def _refresh(self, refresh, frequency, market_open):
+        # called with the lock held: one background fetch for the symbols not already being refreshed wide enough,
+        # returns {symbol: future} of every symbol in refresh
+        futures = {}
+        pending = []
+        for sym, window in refresh:
+            future = self._refreshing.get((sym, frequency))
+            if future is not None and covers_window(future.window, window[0], window[1]):
+                futures[sym] = future
+            else:
+                pending.append((sym, window))
+
+        if pending:
+            bar_count = max(window[0] for sym, window in pending)
+            fields = None
+            if all(window[1] is not None for sym, window in pending):
+                fields = fetch_fields(sorted(set(name for sym, window in pending for name in window[1])))
+            symbols = [sym for sym, window in pending]
+            future = self.executor.submit(self._fetch, symbols, bar_count, frequency, fields, market_open)
+            future.window = (bar_count, fields)
+            for sym in symbols:
+                self._refreshing[(sym, frequency)] = future
+                futures[sym] = future
+
+        return futures
+
+    def _fetch(self, symbols, bar_count, frequency, fields, market_open):
+        try:
+            symbol_bars = self.quote_source.fetch_quotes(symbol=symbols, bar_count=bar_count, frequency=frequency, field=fields, market_open=market_open)
+        except Exception as e:
+            log.error("Error occurred while refreshing quotes for (%s): %s " % (symbols, e))
+            symbol_bars = {}
+
+        fresh_until = self._fresh_until(frequency)
+        with self._lock:
+            self.counts['refreshes'] = self.counts['refreshes'] + 1
+            for sym in symbols:
+                bars = symbol_bars.get(sym)
+                if _has_bars(bars):
+                    self._entries[(sym, frequency)] = (bar_count, fields, bars, fresh_until)
+                else:
+                    # the last good bars stay, the next read tries again
+                    self.counts['refresh_failures'] = self.counts['refresh_failures'] + 1
+                if self._refreshing.get((sym, frequency)) is not None and self._refreshing[(sym, frequency)].window == (bar_count, fields):
+                    self._refreshing.pop((sym, frequency))
+
+        return symbol_bars
+
+    def _fresh_until(self, frequency):
+        # the next bar boundary (see freshness.last_boundary), daily bars below
+        now = datetime.now()
+        if frequency == '1d':
+            # the last daily bar is final once the session closed, it changes again with the next session
+            session_open = now.replace(hour=8, minute=30, second=0, microsecond=0)
+            session_close = now.replace(hour=15, minute=0, second=0, microsecond=0)
+            if np.is_busday(now.date()) and now < session_open:
+                return session_open + timedelta(seconds=self.grace)
+            if np.is_busday(now.date()) and now < session_close:
+                return session_close + timedelta(seconds=self.grace)
+            next_session = np.busday_offset(now.date(), 1, roll='backward').astype(datetime)
+            return datetime.combine(next_session, session_open.time()) + timedelta(seconds=self.grace)
+
+        minute_series = self.allowed_history_frequency[frequency]
+        return last_boundary(now, minute_series) + timedelta(minutes=minute_series, seconds=self.grace)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, entries=len(self._entries))
+
+
+def _has_bars(bars):
+    return bars is not None and len(bars) > 0 and not np.isnan(bars['close'].values.astype(np.float64)).all()
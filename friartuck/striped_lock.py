@@ -0,0 +1,75 @@
+"""
+MIT License
+
+Copyright (c) 2017 Code Society
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from friartuck.latency_stats import LatencyStats
+
+
+class StripedLock(object):
+    """Locks keys (symbols) over a fixed number of stripes, keys on different stripes are held in parallel.
+
+    locked(keys) takes the stripes of all keys in stripe order, so callers locking overlapping sets cannot deadlock.
+    The time spent waiting for stripes held by others is recorded, stats() tells how contended they are.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self.waits = LatencyStats()
+        self.counts = {'acquired': 0, 'contended': 0, 'wait_seconds': 0.0, 'max_wait': 0.0}
+        self._stats_lock = threading.Lock()
+
+    def stripes(self, keys):
+        return sorted(set(hash(key) % len(self._locks) for key in keys))
+
+    @contextmanager
+    def locked(self, keys):
+        stripes = self.stripes(keys)
+        contended = False
+        started = time.time()
+        for stripe in stripes:
+            if not self._locks[stripe].acquire(False):
+                contended = True
+                self._locks[stripe].acquire()
+        waited = time.time() - started
+
+        self.waits.record('wait', waited)
+        with self._stats_lock:
+            self.counts['acquired'] = self.counts['acquired'] + 1
+            if contended:
+                self.counts['contended'] = self.counts['contended'] + 1
+                self.counts['wait_seconds'] = self.counts['wait_seconds'] + waited
+                self.counts['max_wait'] = max(self.counts['max_wait'], waited)
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self._locks[stripe].release()
+
+    def stats(self):
+        with self._stats_lock:
+            counts = dict(self.counts)
+        return dict(counts, stripes=len(self._locks), wait_p50=self.waits.percentile('wait', 50, 0.0), wait_p95=self.waits.percentile('wait', 95, 0.0))